@@ -0,0 +1,64 @@
+''' timing and accuracy of the blur backends against scikit-image's gaussian
+
+    python -m benchmarks.bench_blur --sizes 1024 4096 --sigmas 2 10 20
+
+every backend is timed (best of --repeat runs) on the synthetic texture image and its
+largest absolute deviation from scikit-image is reported. Exits with 1 if a backend
+deviates by more than its --max-error'''
+import argparse
+import sys
+import time
+import numpy as np
+from benchmarks.synthetic import texture
+from hatchybatch import filters
+
+# expected worst case deviation from scikit-image on images in [0, 1]
+MAX_ERROR = {'skimage': 0.0, 'fft': 1e-5, 'iir': 0.05}
+
+
+def benchmark(sizes, sigmas, dtype=np.float64, repeat=3):
+    '''rows of (size, sigma, backend, seconds, max error)'''
+    rows = []
+    for size in sizes:
+        img = texture(size).astype(dtype)
+        for sigma in sigmas:
+            for backend in filters.BACKENDS:
+                seconds = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    filters.gaussian(img, sigma, backend)
+                    seconds.append(time.perf_counter() - start)
+                rows.append((size, sigma, backend, min(seconds), filters.max_error(img, sigma, backend)))
+                print(f'{size:>5} {sigma:>5g} {backend:>8} {min(seconds):9.3f}s {rows[-1][-1]:10.2e}', flush=True)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='benchmarks.bench_blur', description=__doc__.split('\n\n')[-1],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1024, 4096])
+    parser.add_argument('--sigmas', nargs='+', type=float, default=[1, 2, 5, 10, 20])
+    parser.add_argument('--float32', action='store_true', help='blur float32 images')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per backend, the best is kept')
+    parser.add_argument('--max-error', nargs=2, action='append', default=[],
+                        metavar=('BACKEND', 'ERROR'), help='override an allowed deviation')
+    args = parser.parse_args(argv)
+
+    limits = dict(MAX_ERROR)
+    for backend, error in args.max_error:
+        if backend not in filters.BACKENDS:
+            parser.error(f'unknown blur backend "{backend}", use one of {", ".join(filters.BACKENDS)}')
+        try:
+            limits[backend] = float(error)
+        except ValueError:
+            parser.error(f'invalid error value for {backend}: "{error}"')
+    rows = benchmark(args.sizes, args.sigmas, np.float32 if args.float32 else np.float64, args.repeat)
+    failures = [row for row in rows if row[-1] > limits.get(row[2], 0.0)]
+    for size, sigma, backend, _, error in failures:
+        print(f'INACCURATE {backend} size {size} sigma {sigma:g}: {error:.2e} > {limits[backend]:.2e}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+''' per stage benchmarks of the image data model and the tracer on synthetic images
+
+    python -m benchmarks.bench_stages --output results.json
+    python -m benchmarks.bench_stages --baseline results.json --tolerance 0.25
+
+every stage is timed (best of --repeat runs, memoization cleared in between) and memory
+profiled with tracemalloc in a separate run. The tracer runs with a fixed seed and the
+traced geometry is hashed, a baseline with a different hash means the tracing output changed'''
+import argparse
+import hashlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from benchmarks.synthetic import IMAGES, SIZES
+from hatchybatch.models import ImageData, Tracer, ConfigData
+
+STAGES = ('xdog', 'thresholds', 'edgemap', 'flowfield', 'lic', 'hatchpaths', 'contours', 'save_output')
+SEED = 1234
+# differences below these are timer and allocator noise, never regressions
+MIN_DELTA = {'seconds': 0.005, 'peak_bytes': 64 * 2**10}
+
+
+def stage_calls(model, config, state, output):
+    '''(stage name, callable) in pipeline order, the tracer stages share state['tracer']'''
+    def new_tracer():
+        state['tracer'] = Tracer(
+            model.source.shape, model.edgemap, model.xdog_thresholds,
+            model.flowfield_u, model.flowfield_v, model.flowfield_hatch_u, model.flowfield_hatch_v, SEED)
+
+    def hatchpaths():
+        new_tracer()
+        state['tracer'].generate_hatchpaths(
+            ConfigData.band_values(config, '{}_length'),
+            ConfigData.band_values(config, '{}_distance'),
+            ConfigData.band_values(config, '{}_crosshatch'))
+
+    return (
+        ('xdog', lambda: model.generate_XDoG(
+            config['xdog_sigma_high'], config['xdog_sigma_low'], config['xdog_sharp_p'],
+            config['xdog_phi'], config['xdog_epsilon'])),
+        ('thresholds', lambda: model.generate_thresholds(
+            ConfigData.band_values(config, 'thresh_{}_min'),
+            ConfigData.band_values(config, 'thresh_{}_max'))),
+        ('edgemap', lambda: model.generate_edge_map(
+            config['edgemap_sigma'], config['edgemap_thresh_low'], config['edgemap_thresh_high'])),
+        ('flowfield', lambda: model.generate_flow_field(
+            config['flowfield_sigma'], config['flowfield_rho'], config['flowfield_hatch_sigma'])),
+        ('lic', lambda: model.generate_lic()),
+        ('hatchpaths', hatchpaths),
+        ('contours', lambda: state['tracer'].generate_contours(
+            config['edge_length'], config['edge_probability'])),
+        ('save_output', lambda: state['tracer'].save_output(output)),
+    )
+
+
+def run_pipeline(source, config, stages, output, memory=False):
+    '''one seeded run of all stages on a fresh model, returns per stage seconds (or peak
+    tracemalloc bytes with memory=True) and the tracer'''
+    model = ImageData(dtype=ConfigData.dtype(config), blur_backend=config['blur_backend'])
+    model.source = source.astype(model.dtype, copy=False)
+    state = {}
+    results = {}
+    for name, call in stage_calls(model, config, state, output):
+        if name not in stages:
+            continue
+        if memory:
+            tracemalloc.start()
+            call()
+            results[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            call()
+            results[name] = time.perf_counter() - start
+    return results, state.get('tracer')
+
+
+def geometry_hash(tracer):
+    '''sha256 of the traced coordinates, offsets, bands and kinds'''
+    paths = tracer._paths
+    digest = hashlib.sha256()
+    for array in (paths.coords, paths.offsets, paths.bands, paths.kinds):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def benchmark(images, sizes, stages, repeat=3, config=None):
+    '''results dict: meta data, {image/size/stage: {seconds, peak_bytes}} and {image/size: geometry hash}'''
+    config = ConfigData.with_defaults(config or {})
+    # every stage depends on its predecessors, so they always run
+    stages = STAGES[:max(STAGES.index(s) for s in stages) + 1]
+    results = {
+        'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                 'platform': platform.platform(), 'processor': platform.processor(),
+                 'repeat': repeat, 'seed': SEED},
+        'stages': {},
+        'geometry': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='hatchybatch_bench_') as workdir:
+        output = os.path.join(workdir, 'output.svg')
+        for image in images:
+            for size in sizes:
+                source = IMAGES[image](size)
+                seconds = [run_pipeline(source, config, stages, output)[0] for _ in range(repeat)]
+                peaks, tracer = run_pipeline(source, config, stages, output, memory=True)
+                for stage in stages:
+                    results['stages'][f'{image}/{size}/{stage}'] = {
+                        'seconds': min(run[stage] for run in seconds),
+                        'peak_bytes': peaks[stage],
+                    }
+                    print(f'{image:>10} {size:>5} {stage:>12} {min(run[stage] for run in seconds):9.3f}s '
+                          f'{peaks[stage] / 2**20:9.1f} MiB', flush=True)
+                if tracer is not None:
+                    results['geometry'][f'{image}/{size}'] = geometry_hash(tracer)
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta=MIN_DELTA):
+    '''list of regression messages: slower or larger than the baseline by more than tolerance
+    (and by more than min_delta), or changed geometry'''
+    regressions = []
+    for key, current in results['stages'].items():
+        if key not in baseline.get('stages', {}):
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            reference = baseline['stages'][key][metric]
+            if reference and current[metric] > max(reference * (1 + tolerance), reference + min_delta[metric]):
+                regressions.append(
+                    f'{key} {metric}: {current[metric]:.4g} > {reference:.4g} (+{current[metric] / reference - 1:.0%})')
+    for key, digest in results['geometry'].items():
+        reference = baseline.get('geometry', {}).get(key)
+        if reference is not None and reference != digest:
+            regressions.append(f'{key} geometry changed')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='benchmarks.bench_stages', description=__doc__.split('\n\n')[-1],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', nargs='+', choices=sorted(IMAGES), default=sorted(IMAGES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES))
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                        help='stages to report (their predecessors always run)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage, the best is kept')
+    parser.add_argument('-c', '--config', help='config JSON, defaults to the GUI defaults')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown / memory growth (default: 0.25)')
+    parser.add_argument('--min-seconds', type=float, default=MIN_DELTA['seconds'],
+                        help=f'slowdowns up to this many seconds are ignored (default: {MIN_DELTA["seconds"]:g})')
+    parser.add_argument('--min-bytes', type=int, default=MIN_DELTA['peak_bytes'],
+                        help=f'memory growth up to this many bytes is ignored (default: {MIN_DELTA["peak_bytes"]})')
+    args = parser.parse_args(argv)
+
+    config = ConfigData().load_config(args.config) if args.config else None
+    results = benchmark(args.images, args.sizes, args.stages, args.repeat, config)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance,
+                                  {'seconds': args.min_seconds, 'peak_bytes': args.min_bytes})
+        for regression in regressions:
+            print('REGRESSION', regression)
+        print(f'{len(regressions)} regressions against {args.baseline}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
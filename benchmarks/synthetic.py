@@ -0,0 +1,57 @@
+import numpy as np
+from skimage.draw import circle_perimeter_aa, disk, line_aa
+from skimage.filters import gaussian
+
+SIZES = (512, 1024, 2048, 4096)
+
+
+def gradient(size, seed=0):
+    '''linear ramp blended with a radial falloff, no edges and every tone band present'''
+    y, x = np.mgrid[0:size, 0:size] / (size - 1)
+    radial = np.hypot(x - 0.3, y - 0.6)
+    return np.clip(0.6 * x + 0.4 * (1 - radial), 0, 1)
+
+
+def noise(size, seed=0):
+    '''lightly blurred uniform noise, the worst case for edge detection and tracing'''
+    rng = np.random.default_rng(seed)
+    return np.clip(gaussian(rng.random((size, size)), sigma=1), 0, 1)
+
+
+def line_art(size, seed=0):
+    '''black antialiased lines and circles on white'''
+    rng = np.random.default_rng(seed)
+    img = np.ones((size, size))
+    for _ in range(size // 16):
+        r0, c0, r1, c1 = rng.integers(0, size, 4)
+        rr, cc, val = line_aa(r0, c0, r1, c1)
+        img[rr, cc] = np.minimum(img[rr, cc], 1 - val)
+    for _ in range(size // 32):
+        r, c = rng.integers(0, size, 2)
+        rr, cc, val = circle_perimeter_aa(r, c, int(rng.integers(4, size // 8)), shape=img.shape)
+        img[rr, cc] = np.minimum(img[rr, cc], 1 - val)
+    return img
+
+
+def texture(size, seed=0):
+    '''photo-like image: smooth lighting, multi-scale noise texture and flat shapes with sharp edges'''
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / (size - 1)
+    img = 0.5 + 0.3 * np.sin(2.5 * x + 1.5 * y)
+    for octave in range(2, 7):
+        sigma = size / 2 ** (octave + 1)
+        layer = gaussian(rng.standard_normal((size, size)), sigma=sigma)
+        img += 0.5 ** octave * layer / (np.abs(layer).max() or 1)
+    for _ in range(12):
+        rr, cc = disk(tuple(rng.integers(0, size, 2)), rng.integers(size // 32, size // 6), shape=img.shape)
+        img[rr, cc] = 0.7 * img[rr, cc] + 0.3 * rng.random()
+    img -= img.min()
+    return img / img.max()
+
+
+IMAGES = {
+    'gradient': gradient,
+    'noise': noise,
+    'line_art': line_art,
+    'texture': texture,
+}
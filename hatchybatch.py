@@ -1,4 +1,11 @@
-from hatchybatch.application import Controller
+import logging
+import sys
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # headless batch mode, see "python hatchybatch.py --help"
+        from hatchybatch.batch import main
+        sys.exit(main())
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    from hatchybatch.application import Controller
     app = Controller()
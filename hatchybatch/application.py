@@ -1,11 +1,23 @@
 import tkinter as tk
 from tkinter import filedialog
 from hatchybatch.views import Mainview, StatusBar
-from hatchybatch.models import ImageData, Tracer, ConfigData
-from threading import Thread
+from hatchybatch.cache import DiskCache
+from hatchybatch.instrument import Recorder
+from hatchybatch.models import ImageData, ConfigData, iter_stages, calculate_stages, trace
+from hatchybatch.scheduler import Scheduler
+from time import perf_counter
 
 
 class Controller():
+    # downsampling of the proxy image in the progressive preview mode
+    PREVIEW_SCALE = 0.25
+    # milliseconds without further changes before a changed setting is recomputed
+    DEBOUNCE = 150
+    # stage recomputed when one of its settings (ConfigData.STAGE_KEYS) changes, by prefix,
+    # everything else (precision, blur backend) recalculates all stages
+    LIVE_STAGES = {'xdog': 'show_XDoG', 'thresh': 'show_thresholds',
+                   'edgemap': 'show_edgemap', 'flowfield': 'show_flowfield'}
+
     def __init__(self):
         self.root = tk.Tk()
         self.xdog_sigma_high = tk.DoubleVar()
@@ -51,6 +63,21 @@ class Controller():
         self.xdog_output = tk.BooleanVar()
         self.edges_output = tk.BooleanVar()
         self.hatch_output = tk.BooleanVar()
+        self.vectorized_tracing = tk.BooleanVar()
+        self.tracing_workers = tk.IntVar()
+        self.seed = tk.IntVar()
+        self.progressive_preview = tk.BooleanVar()
+        self.even_spacing = tk.BooleanVar()
+        self.simplify_tolerance = tk.DoubleVar()
+        self.optimize_travel = tk.BooleanVar()
+        self.profile_memory = tk.BooleanVar()
+        self.float32_pipeline = tk.BooleanVar()
+        self.blur_backend = tk.StringVar()
+
+        self.plot_width = tk.DoubleVar()
+        self.plot_feed_rate = tk.DoubleVar()
+        self.plot_pen_up = tk.StringVar()
+        self.plot_pen_down = tk.StringVar()
 
         self.status_text = tk.StringVar()
 
@@ -60,52 +87,16 @@ class Controller():
         self.main_view.pack(side='top', fill='both')
         self.status_bar.pack(side='bottom', fill='x')
 
-        self.model = ImageData()
+        self.recorder = Recorder()
+        self.model = ImageData(disk_cache=DiskCache(), recorder=self.recorder)
+        self.scheduler = Scheduler(self.root, on_poll=self.show_progress)
         ######### Initial Values #########
-        self.xdog_sigma_high.set(1.8)
-        self.xdog_sigma_low.set(1.0)
-        self.xdog_sharp_p.set(20)
-        self.xdog_phi.set(0.1)
-        self.xdog_epsilon.set(20)
-
-        self.edgemap_sigma.set(2.0)
-        self.edgemap_thresh_low.set(0.1)
-        self.edgemap_thresh_high.set(0.2)
-
-        self.flowfield_sigma.set(1.5)
-        self.flowfield_rho.set(5.5)
-        self.flowfield_hatch_sigma.set(1.0)
-
-        self.thresh_low_min.set(0.1)
-        self.thresh_low_max.set(0.2)
-        self.thresh_midlow_min.set(0.2)
-        self.thresh_midlow_max.set(0.4)
-        self.thresh_midhigh_min.set(0.4)
-        self.thresh_midhigh_max.set(0.6)
-        self.thresh_high_min.set(0.6)
-        self.thresh_high_max.set(0.9)
-
-        self.edge_probability.set(0.5)
-        self.edge_length.set(5)
-        self.low_length.set(20)
-        self.midlow_length.set(20)
-        self.midhigh_length.set(20)
-        self.high_length.set(20)
-
-        self.low_distance.set(4)
-        self.midlow_distance.set(7)
-        self.midhigh_distance.set(10)
-        self.high_distance.set(20)
-
-        self.low_crosshatch.set(False)
-        self.midlow_crosshatch.set(False)
-        self.midhigh_crosshatch.set(False)
-        self.high_crosshatch.set(False)
-
-        self.xdog_output.set(True)
-        self.edges_output.set(True)
-        self.hatch_output.set(True)
+        for name, value in ConfigData.DEFAULTS.items():
+            getattr(self, name).set(value)
+            getattr(self, name).trace_add(
+                'write', lambda *args, name=name: self.parameters_changed(name))
         self.status_text.set("Ready")
+        self.scheduler.start()
 
         self.run()
 
@@ -119,20 +110,75 @@ class Controller():
         f = filedialog.askopenfilename(
             filetypes=[('Supported Images', '.png .jpg .jpeg .tif .tiff .bmp')])
         if f:
-            self.model.load_image(f)
-            self.run_threaded(self.calculate_all)
+            # the jobs of the previous image must not draw or install their results
+            self.scheduler.cancel('full')
+            self.scheduler.cancel('all')
+            self.schedule('load', lambda job, config: self.model.load_image(f),
+                          lambda result: self.recalculate())
 
     def save_output(self):
         f = filedialog.asksaveasfilename(
-            filetypes=[('HatchyBatch Output', '.svg')], defaultextension=".svg")
+            filetypes=[('HatchyBatch Output', '.svg'),
+                       ('G-code', '.gcode .nc .ngc'),
+                       ('HPGL', '.hpgl .plt')], defaultextension=".svg")
         if f:
-            self.tracer.save_output(f)
+            self.schedule('save', lambda job, config: self.write_output(config, f), self.output_saved)
 
-    def save_config(self):
+    def write_output(self, config, filename):
+        '''optimize the pen-up travel (if enabled) and write the output file, returns the travel before and after'''
+        travel = self.tracer.optimize_travel() if config['optimize_travel'] else None
+        self.tracer.save_output(filename, **ConfigData.plotter_settings(config))
+        return travel
+
+    def output_saved(self, travel):
+        if travel is None:
+            self.status_text.set('Saved')
+        else:
+            self.status_text.set(
+                f'Saved - pen-up travel {travel[0]:.0f} px -> {travel[1]:.0f} px')
+
+    def get_config(self):
+        '''current values of all parameter variables'''
         config = {}
-        for name, obj in vars(self).items():
-            if isinstance(obj, (tk.DoubleVar, tk.IntVar, tk.BooleanVar)):
-                config[name] = obj.get()
+        for name in ConfigData.DEFAULTS:
+            config[name] = getattr(self, name).get()
+        return config
+
+    def parameters_changed(self, name):
+        '''cancels the full resolution job of the progressive preview and a running
+        recalculation (both use the old settings), recomputes the stage of a changed stage
+        setting once the setting rests for DEBOUNCE milliseconds and restarts an interrupted
+        recalculation'''
+        self.recorder.trace_memory = bool(self.profile_memory.get())
+        self.scheduler.cancel('full')
+        interrupted = self.scheduler.cancel('all')
+        if self.model.source is None:
+            return
+        live = self.LIVE_STAGES.get(name.split('_')[0]) if name in ConfigData.STAGE_KEYS else None
+        if live is not None:
+            getattr(self, live)(delay=self.DEBOUNCE)
+        if interrupted or (name in ConfigData.STAGE_KEYS and live is None):
+            self.recalculate(delay=self.DEBOUNCE)
+
+    def schedule(self, key, work, done=None, delay=0):
+        '''run work(job, config) on the scheduler with the current settings, superseding
+        the job with the same key; done(result) is called on the Tk main loop'''
+        config = self.get_config()
+        return self.scheduler.submit(key, lambda job: work(job, config), done, self.job_failed, delay)
+
+    def job_failed(self, error):
+        if self.model.source is None:
+            self.status_text.set("You have to open a bitmap image first...")
+        else:
+            self.status_text.set(f'Calculation failed: {error}')
+
+    def apply_settings(self, config):
+        '''model settings that invalidate stages, applied by the jobs before calculating'''
+        self.model.set_dtype(ConfigData.dtype(config))
+        self.model.set_blur_backend(config['blur_backend'])
+
+    def save_config(self):
+        config = self.get_config()
 
         f = filedialog.asksaveasfilename(
             filetypes=[('HatchyBatch configuration file', '.json')], defaultextension=".json")
@@ -145,160 +191,219 @@ class Controller():
         if f:
             try:
                 config = ConfigData().load_config(f)
-                for name, obj in vars(self).items():
-                    if isinstance(obj, (tk.DoubleVar, tk.IntVar, tk.BooleanVar)):
-                        obj.set(config[name])
+                for name in ConfigData.DEFAULTS:
+                    if name in config:
+                        getattr(self, name).set(config[name])
             except:
                 self.status_text.set(
                     f"There was a problem parsing the config file")
 
     def show_image(self):
-        self.main_view.control_frame.original.imshow(
-            self.model.source, 'gray')
-        self.main_view.control_frame.canvas.draw()
+        self.draw_image(self.model)
+
+    def show_XDoG(self, delay=0):
+        self.schedule('xdog', self.calculate_XDoG, self.draw_xdog, delay)
 
-    def show_XDoG(self):
+    def calculate_XDoG(self, job, config):
+        self.apply_settings(config)
         self.model.generate_XDoG(
-            self.xdog_sigma_high.get(),
-            self.xdog_sigma_low.get(),
-            self.xdog_sharp_p.get(),
-            self.xdog_phi.get(),
-            self.xdog_epsilon.get())
-        self.show_thresholds()
-        self.main_view.control_frame.xdog.imshow(
-            self.model.xdog, 'gray')
-        self.main_view.control_frame.canvas.draw()
-
-    def show_DoG(self):
+            config['xdog_sigma_high'],
+            config['xdog_sigma_low'],
+            config['xdog_sharp_p'],
+            config['xdog_phi'],
+            config['xdog_epsilon'])
+        job.check()
+        job.post(self.draw_thresholds, self.calculate_thresholds(job, config))
+        return self.model
+
+    def show_DoG(self, delay=0):
+        self.schedule('dog', self.calculate_DoG, self.draw_dog, delay)
+
+    def calculate_DoG(self, job, config):
+        self.apply_settings(config)
         self.model.generate_DoG(
-            self.xdog_sigma_high.get(),
-            self.xdog_sigma_low.get(),
+            config['xdog_sigma_high'],
+            config['xdog_sigma_low'],
             threshold=0.4)
-        self.main_view.control_frame.xdog.imshow(
-            self.model.dog, 'gray')
-        self.main_view.control_frame.canvas.draw()
+        return self.model
 
-    def show_edgemap(self):
+    def show_edgemap(self, delay=0):
+        self.schedule('edgemap', self.calculate_edgemap, self.draw_edgemap, delay)
+
+    def calculate_edgemap(self, job, config):
+        self.apply_settings(config)
         self.model.generate_edge_map(
-            self.edgemap_sigma.get(),
-            self.edgemap_thresh_low.get(),
-            self.edgemap_thresh_high.get())
-        self.main_view.control_frame.edgemap.imshow(
-            self.model.edgemap, 'gray')
-        self.main_view.control_frame.canvas.draw()
-
-    def show_flowfield(self):
-        self.model.generate_flow_field(
-            self.flowfield_sigma.get(), self.flowfield_rho.get(), self.flowfield_hatch_sigma.get())
-        self.model.generate_lic()
-        self.main_view.control_frame.flow_field.imshow(
-            self.model.lic, 'gray')
-        self.main_view.control_frame.canvas.draw()
+            config['edgemap_sigma'],
+            config['edgemap_thresh_low'],
+            config['edgemap_thresh_high'])
+        return self.model
+
+    def show_flowfield(self, delay=0):
+        '''flow field with the fast LIC preview, drawn after every refinement'''
+        self.schedule('flowfield', self.calculate_flowfield, delay=delay)
 
-    def show_thresholds(self):
+    def calculate_flowfield(self, job, config):
+        self.apply_settings(config)
+        self.model.generate_flow_field(
+            config['flowfield_sigma'], config['flowfield_rho'], config['flowfield_hatch_sigma'])
+        job.check()
+        self.model.generate_lic_preview(
+            cancelled=lambda: job.cancelled,
+            on_pass=lambda image: job.post(self.draw_flowfield, self.model, image))
+        return self.model
+
+    def show_full_lic(self):
+        '''full resolution LIC of the current flow field, on demand'''
+        self.schedule('lic', lambda job, config: self.model.generate_lic(),
+                      lambda result: self.draw_flowfield(self.model, self.model.lic))
+
+    def show_thresholds(self, delay=0):
+        self.schedule('thresholds', self.calculate_thresholds, self.draw_thresholds, delay)
+
+    def calculate_thresholds(self, job, config):
+        self.apply_settings(config)
         self.model.generate_thresholds(
-            [self.thresh_low_min.get(),
-             self.thresh_midlow_min.get(),
-             self.thresh_midhigh_min.get(),
-             self.thresh_high_min.get()],
-            [self.thresh_low_max.get(),
-             self.thresh_midlow_max.get(),
-             self.thresh_midhigh_max.get(),
-             self.thresh_high_max.get()])
-
-        self.main_view.threshold_frame.thresh_low.imshow(
-            self.model.thresholds[0], 'gray')
-        self.main_view.threshold_frame.thresh_midlow.imshow(
-            self.model.thresholds[1], 'gray')
-        self.main_view.threshold_frame.thresh_midhigh.imshow(
-            self.model.thresholds[2], 'gray')
-        self.main_view.threshold_frame.thresh_high.imshow(
-            self.model.thresholds[3], 'gray')
-        self.main_view.threshold_frame.canvas.draw()
-
-        self.main_view.xdog_threshold_frame.thresh_low.imshow(
-            self.model.xdog_thresholds[0], 'gray')
-        self.main_view.xdog_threshold_frame.thresh_midlow.imshow(
-            self.model.xdog_thresholds[1], 'gray')
-        self.main_view.xdog_threshold_frame.thresh_midhigh.imshow(
-            self.model.xdog_thresholds[2], 'gray')
-        self.main_view.xdog_threshold_frame.thresh_high.imshow(
-            self.model.xdog_thresholds[3], 'gray')
-        self.main_view.xdog_threshold_frame.canvas.draw()
-
-    def calculate_all(self):
-        try:
-            self.show_image()
-            self.show_XDoG()
-            # self.show_DoG()
-            self.show_edgemap()
-            self.show_flowfield()
-            # self.trace_image()
-        except Exception as e:
-            print(e)
-            self.status_text.set("You have to open a bitmap image first...")
+            ConfigData.band_values(config, 'thresh_{}_min'),
+            ConfigData.band_values(config, 'thresh_{}_max'))
+        return self.model
+
+    def draw_image(self, model):
+        self.main_view.control_frame.show(
+            self.main_view.control_frame.original, model.source)
+        self.main_view.control_frame.redraw()
+
+    def draw_xdog(self, model):
+        self.main_view.control_frame.show(
+            self.main_view.control_frame.xdog, model.xdog)
+        self.main_view.control_frame.redraw()
+
+    def draw_dog(self, model):
+        self.main_view.control_frame.show(
+            self.main_view.control_frame.xdog, model.dog)
+        self.main_view.control_frame.redraw()
+
+    def draw_edgemap(self, model):
+        self.main_view.control_frame.show(
+            self.main_view.control_frame.edgemap, model.edgemap)
+        self.main_view.control_frame.redraw()
+
+    def draw_flowfield(self, model, image=None):
+        '''LIC image (the preview by default) stretched over the source pixel coordinates'''
+        image = model.lic_preview if image is None else image
+        self.main_view.control_frame.show(
+            self.main_view.control_frame.flow_field, image, model.source.shape)
+        self.main_view.control_frame.redraw()
+
+    def draw_thresholds(self, model):
+        for frame, masks in ((self.main_view.threshold_frame, model.thresholds),
+                             (self.main_view.xdog_threshold_frame, model.xdog_thresholds)):
+            for ax, mask in zip((frame.thresh_low, frame.thresh_midlow,
+                                 frame.thresh_midhigh, frame.thresh_high), masks):
+                frame.show(ax, mask)
+            frame.redraw()
+
+    def draw_all(self, model):
+        self.draw_image(model)
+        self.draw_thresholds(model)
+        self.draw_xdog(model)
+        self.draw_edgemap(model)
+        self.draw_flowfield(model)
+
+    def export_profile(self):
+        f = filedialog.asksaveasfilename(
+            filetypes=[('Chrome trace / JSON report', '.json')], defaultextension=".json")
+        if f:
+            self.recorder.write(f)
+            self.status_text.set(
+                f'{len(self.recorder.events)} stage records written to {f}')
+
+    def recalculate(self, delay=0):
+        self.scheduler.cancel('full')
+        self.schedule('all', self.calculate_all, self.calculation_done, delay)
+
+    def calculate_all(self, job, config):
+        '''all stages of the loaded image, each one is drawn as soon as it is done'''
+        self.recorder.clear()
+        self.apply_settings(config)
+        if config['progressive_preview']:
+            return self.calculate_progressive(job, config)
+        job.post(self.draw_image, self.model)
+        draw = {'xdog': self.draw_xdog, 'thresholds': self.draw_thresholds,
+                'edgemap': self.draw_edgemap}
+        for stage in iter_stages(self.model, config):
+            job.check()
+            if stage in draw:
+                job.post(draw[stage], self.model)
+        self.model.generate_lic_preview(cancelled=lambda: job.cancelled)
+        job.check()
+        job.post(self.draw_flowfield, self.model)
+        return self.model
+
+    def calculate_progressive(self, job, config):
+        '''stages and tracing on a downsampled proxy first, the full resolution result
+        follows as the "full" job, which is cancelled as soon as a setting changes'''
+        preview = self.model.proxy(self.PREVIEW_SCALE)
+        preview_config = ConfigData.scaled(config, self.PREVIEW_SCALE)
+        calculate_stages(preview, preview_config)
+        preview.generate_lic_preview(20 * self.PREVIEW_SCALE)
+        job.check()
+        job.post(self.draw_all, preview)
+        tracer = trace(preview, preview_config)
+        tracer._paths.scale(1 / self.PREVIEW_SCALE)
+        tracer.imageshape = self.model.source.shape
+        job.check()
+        job.post(self.set_tracer, tracer)
+        # the full resolution job is cancelled with this one, even if that happens right after the check
+        job.check()
+        self.scheduler.submit('full', lambda full: self.calculate_full_resolution(full, config),
+                              self.set_tracer, self.job_failed, parent=job)
+        return preview
+
+    def calculate_full_resolution(self, job, config):
+        '''full resolution stages and tracing, abandoned at the next stage boundary once cancelled'''
+        for stage in iter_stages(self.model, config):
+            job.check()
+        self.model.generate_lic_preview(cancelled=lambda: job.cancelled)
+        job.check()
+        tracer = trace(self.model, config)
+        job.check()
+        job.post(self.draw_all, self.model)
+        return tracer
+
+    def calculation_done(self, model):
+        if hasattr(self, 'tracer'):
+            self.status_text.set(f'Done. - {self.output_summary()}')
+        else:
+            self.status_text.set(
+                'You have to load and trace an image first...')
 
     def trace_image(self):
-        self.tracer = Tracer(
-            self.model.source.shape,
-            self.model.edgemap,
-            self.model.xdog_thresholds if self.xdog_output.get() else self.model.thresholds,
-            self.model.flowfield_u,
-            self.model.flowfield_v,
-            self.model.flowfield_hatch_u,
-            self.model.flowfield_hatch_v)
-        if self.edges_output.get():
-            self.tracer.generate_contours(
-                self.edge_length.get(), self.edge_probability.get())
-        if self.hatch_output.get():
-            self.tracer.generate_hatchpaths(
-                [self.low_length.get(), self.midlow_length.get(),
-                 self.midhigh_length.get(), self.high_length.get()],
-                [self.low_distance.get(), self.midlow_distance.get(),
-                 self.midhigh_distance.get(), self.high_distance.get()],
-                [self.low_crosshatch.get(), self.midlow_crosshatch.get(),
-                 self.midhigh_crosshatch.get(), self.high_crosshatch.get()])
-        self.status_text.set(f'{len(self.tracer._paths)} paths in output')
+        self.schedule('trace', lambda job, config: trace(self.model, config), self.set_tracer)
+
+    def set_tracer(self, tracer):
+        self.tracer = tracer
+        self.status_text.set(f'Done. - {self.output_summary()}')
+
+    def output_summary(self):
+        before, after = self.tracer.vertex_counts
+        return f'{len(self.tracer._paths)} paths in output, {after} of {before} vertices after simplification'
 
     def show_output(self):
         if hasattr(self, 'tracer'):
             self.tracer.show_preview()
 
-    def disable_buttons(self):
-        for button in self.main_view.buttons.winfo_children():
-            try:
-                if button.widgetName != 'frame':
-                    button.configure(state='disabled')
-            except Exception as e:
-                print(e)
-
-    def enable_buttons(self):
-        for button in self.main_view.buttons.winfo_children():
-            try:
-                if button.widgetName != 'frame':
-                    button.configure(state='normal')
-            except Exception as e:
-                print(e)
-
-    def run_threaded(self, target):
-        try:
-            self.disable_buttons()
-            thread = Thread(target=target)
-            thread.start()
-            self.check_thread(thread)
-        except Exception as e:
-            print(e)
-
-    def check_thread(self, thread):
-        if thread.is_alive():
-            self.status_text.set('Calculating...Please be patient')
-            self.root.after(300, self.check_thread, thread)
+    def progress_text(self):
+        '''running stage and its elapsed time, as far as the recorder knows'''
+        stage, start = self.recorder.current, self.recorder.current_start
+        if stage is None:
+            return f'Calculating... {len(self.recorder.events)} stages done'
+        return f'Calculating {stage}... {perf_counter() - start:.1f}s ({len(self.recorder.events)} stages done)'
+
+    def show_progress(self, job):
+        '''status bar while a job is running, called by the scheduler on the main loop'''
+        if job is None:
+            return
+        if job.key == 'full':
+            self.status_text.set('Preview ready - calculating full resolution...')
         else:
-            if hasattr(self, 'tracer'):
-                self.enable_buttons()
-                self.status_text.set(
-                    f'Done. - {len(self.tracer._paths)} paths in output')
-            else:
-                self.enable_buttons()
-                self.status_text.set(
-                    'You have to load and trace an image first...')
+            self.status_text.set(self.progress_text())
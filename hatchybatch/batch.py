@@ -0,0 +1,146 @@
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from hatchybatch.cache import DiskCache
+from hatchybatch.instrument import Recorder, logger
+from hatchybatch.models import ImageData, ConfigData, calculate_stages, trace
+from hatchybatch.ordering import travel_distance
+from hatchybatch.tiling import TiledImageData
+
+
+def available_cores():
+    '''number of cores this process may run on'''
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def render(filename, config, output_dir, tile_size=None, extension='.svg', cache_dir=None, profile_dir=None,
+           profile_memory=False):
+    '''render a single image to an SVG in output_dir, returns the output name, path count, stage timings
+    and the vertex counts and pen-up travel before and after simplification and ordering
+
+    with a tile_size the image is processed at full resolution by TiledImageData, the
+    extension selects the output format (see Tracer.save_output). Untiled stages are stored in
+    and loaded from a DiskCache in cache_dir, if given. With a profile_dir the stage records
+    are written there as <name>.trace.json (see Recorder.write), with peak memory per stage if
+    profile_memory'''
+    clock = [time.perf_counter()]
+    recorder = Recorder(profile_memory)
+    if tile_size is not None:
+        model = TiledImageData(tile_size, recorder=recorder)
+    else:
+        model = ImageData(DiskCache(cache_dir) if cache_dir else None, recorder,
+                          ConfigData.dtype(config), config['blur_backend'])
+    try:
+        model.load_image(filename)
+        clock.append(time.perf_counter())
+        calculate_stages(model, config)
+        clock.append(time.perf_counter())
+        tracer = trace(model, config)
+        clock.append(time.perf_counter())
+        if config['optimize_travel']:
+            travel = tracer.optimize_travel()
+        else:
+            travel = (travel_distance(tracer._paths),) * 2
+        clock.append(time.perf_counter())
+        output = os.path.join(output_dir, os.path.splitext(
+            os.path.basename(filename))[0] + extension)
+        tracer.save_output(output, **ConfigData.plotter_settings(config))
+        clock.append(time.perf_counter())
+    finally:
+        if tile_size is not None:
+            model.close()
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+            recorder.write(os.path.join(profile_dir, os.path.splitext(
+                os.path.basename(filename))[0] + '.trace.json'))
+    timings = dict(zip(('load', 'stages', 'trace', 'order', 'save'), np.diff(clock).tolist()))
+    timings['total'] = clock[-1] - clock[0]
+    stats = {'vertices': tracer.vertex_counts, 'travel': travel}
+    return output, len(tracer._paths), timings, stats
+
+
+def print_summary(results, failures, elapsed, out=sys.stdout):
+    '''per file timing table'''
+    columns = ('load', 'stages', 'trace', 'order', 'save', 'total')
+    width = max([len(os.path.basename(f)) for f in list(results) + list(failures)] + [4])
+    print(f'{"file":<{width}}  {"paths":>8}  {"vertices":>19}  {"travel (px)":>21}  ' +
+          '  '.join(f'{c:>8}' for c in columns), file=out)
+    for filename, (output, count, timings, stats) in results.items():
+        vertices = '{} -> {}'.format(*stats['vertices'])
+        travel = '{:.0f} -> {:.0f}'.format(*stats['travel'])
+        print(f'{os.path.basename(filename):<{width}}  {count:>8}  {vertices:>19}  {travel:>21}  ' +
+              '  '.join(f'{timings[c]:>7.2f}s' for c in columns), file=out)
+    for filename, error in failures.items():
+        print(f'{os.path.basename(filename):<{width}}  failed: {error}', file=out)
+    print(f'{len(results)} rendered, {len(failures)} failed in {elapsed:.2f}s', file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='hatchybatch', description='render a batch of images to hatched SVGs without the GUI')
+    parser.add_argument('input', help='input image glob, e.g. "photos/*.jpg"')
+    parser.add_argument('-c', '--config', help='config JSON as written by "Save config..."')
+    parser.add_argument('-o', '--output', default='.', help='output directory')
+    parser.add_argument('-j', '--workers', type=int, default=available_cores(),
+                        help='number of worker processes (default: available cores)')
+    parser.add_argument('-t', '--tracing-workers', type=int,
+                        help='trace each file in this many processes (overrides the config setting '
+                        'tracing_workers), for few large files on many cores')
+    parser.add_argument('-f', '--format', choices=('svg', 'gcode', 'hpgl'), default='svg',
+                        help='output format, plotter settings are taken from the config (default: svg)')
+    parser.add_argument('--cache-dir', nargs='?', const=DiskCache.DEFAULT_DIRECTORY,
+                        help='reuse stages of already rendered images from an on-disk cache '
+                        f'(default directory: {DiskCache.DEFAULT_DIRECTORY})')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='write per stage timings, memory and path counts as Chrome trace JSON files to DIR')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='add the peak memory of every stage to the profiles (slows down the tracing)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every stage')
+    parser.add_argument('--tiled', action='store_true',
+                        help='process images at full resolution in memory-mapped tiles')
+    parser.add_argument('--tile-size', type=int, default=1024,
+                        help='tile size in pixels for --tiled (default: 1024)')
+    args = parser.parse_args(argv)
+    # set the level on our logger, importing lic already configures the root logger
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    logger.setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    files = sorted(glob.glob(args.input, recursive=True))
+    if not files:
+        parser.error(f'no files match "{args.input}"')
+    config = ConfigData.with_defaults(
+        ConfigData().load_config(args.config) if args.config else {})
+    if args.tracing_workers is not None:
+        config['tracing_workers'] = args.tracing_workers
+    os.makedirs(args.output, exist_ok=True)
+
+    results = {}
+    failures = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(files)))) as pool:
+        jobs = {pool.submit(render, f, config, args.output, args.tile_size if args.tiled else None,
+                            '.' + args.format, args.cache_dir, args.profile, args.profile_memory): f
+                for f in files}
+        for job in as_completed(jobs):
+            filename = jobs[job]
+            try:
+                results[filename] = job.result()
+                print(f'{filename} -> {results[filename][0]}')
+            except Exception as e:
+                failures[filename] = e
+                print(f'{filename} failed: {e}', file=sys.stderr)
+    results = {f: results[f] for f in files if f in results}
+    print_summary(results, failures, time.perf_counter() - start)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
+
+
+class BlurCache():
+    '''least recently used cache for the gaussian blurs of one image, keyed by sigma
+
+    the cache is bounded by the total size of the stored arrays in bytes, the
+    returned arrays are shared between callers and therefore read only'''
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, sigma, compute):
+        '''return the cached blur for sigma, calling compute() on a miss'''
+        key = float(sigma)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        result = compute()
+        result.flags.writeable = False
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = result
+                self._nbytes += result.nbytes
+            self._evict()
+        return result
+
+    def _evict(self):
+        '''drop least recently used blurs until the size limit holds, the newest entry is always kept'''
+        while self._nbytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+
+class DiskCache():
+    '''content addressed on-disk cache of arrays, shared between sessions and processes
+
+    entries are .npy files named by the sha256 of their key (image digest, stage name and
+    parameters), hits are loaded memory-mapped and read only. The directory is bounded by
+    max_bytes, the least recently used files (by modification time, refreshed on every hit)
+    are removed first'''
+    DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'hatchybatch')
+
+    def __init__(self, directory=None, max_bytes=2 * 2**30):
+        self.directory = directory or self.DEFAULT_DIRECTORY
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def digest(data):
+        '''sha256 hex digest of bytes, e.g. the contents of an image file'''
+        return hashlib.sha256(data).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, self.digest(repr(key).encode()) + '.npy')
+
+    def get(self, key, compute):
+        '''the cached array for key, calling compute() and storing its result on a miss'''
+        path = self.path(key)
+        try:
+            value = np.asarray(np.load(path, mmap_mode='r'))
+            os.utime(path)
+            with self._lock:
+                self.hits += 1
+            return value
+        except (OSError, ValueError):
+            pass
+        with self._lock:
+            self.misses += 1
+        value = np.asarray(compute())
+        # write to a private file first, concurrent readers only ever see complete entries
+        handle, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                np.save(f, value)
+            os.replace(temp, path)
+        except OSError:
+            if os.path.exists(temp):
+                os.remove(temp)
+            return value
+        self.evict()
+        return value
+
+    def entries(self):
+        '''(modification time, size, path) of all cache files'''
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                except OSError:
+                    pass
+        return entries
+
+    @property
+    def nbytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        '''remove least recently used files until the directory fits into max_bytes, the newest file is always kept'''
+        with self._lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries[:-1]:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            for _, _, path in self.entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
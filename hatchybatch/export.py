@@ -0,0 +1,119 @@
+import os
+import numpy as np
+
+# file extensions of the plotter formats, everything else is written as SVG
+GCODE_EXTENSIONS = ('.gcode', '.nc', '.ngc')
+HPGL_EXTENSIONS = ('.hpgl', '.plt')
+# HPGL plotter units per millimeter
+HPGL_UNITS = 40
+
+
+class PlotterWriter():
+    '''base class of the streaming plotter exporters
+
+    polylines in image pixel coordinates are written one at a time as they are passed to
+    write(), so the memory use does not depend on the size of the job. The image is scaled to
+    width millimeters and flipped vertically, the plotter origin is the lower left corner'''
+
+    def __init__(self, filename, imageshape, width=200.0, feed_rate=3000.0,
+                 pen_up='G0 Z5', pen_down='G0 Z0'):
+        self.filename = filename
+        self.height = imageshape[0]
+        self.scale = float(width) / imageshape[1]
+        self.feed_rate = float(feed_rate)
+        self.pen_up = pen_up
+        self.pen_down = pen_down
+        self.count = 0
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.filename, 'w')
+        self.write_header()
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.write_footer()
+        finally:
+            self._file.close()
+
+    def to_plotter(self, points):
+        '''pixel coordinates to millimeters with the y axis pointing up'''
+        points = np.asarray(points, dtype=np.float64)
+        return np.stack((points[:, 0] * self.scale, (self.height - points[:, 1]) * self.scale), axis=1)
+
+    def write_all(self, paths):
+        for points in paths:
+            self.write(points)
+
+    def write_header(self):
+        pass
+
+    def write_footer(self):
+        pass
+
+    def write(self, points):
+        raise NotImplementedError
+
+
+class GcodeWriter(PlotterWriter):
+    '''G-code: rapid moves with the pen up, feed moves with the pen down, millimeters, absolute positioning'''
+
+    def write_header(self):
+        self._file.write(f'; hatchybatch, {self.scale * self.height:.1f} mm high\n'
+                         'G21\nG90\n' + self.pen_up + '\n')
+
+    def write_footer(self):
+        self._file.write(f'{self.pen_up}\nG0 X0 Y0\nM2\n')
+
+    def write(self, points):
+        if len(points) < 2:
+            return
+        coords = self.to_plotter(points).tolist()
+        x, y = coords[0]
+        lines = [f'G0 X{x:.3f} Y{y:.3f}', self.pen_down]
+        x, y = coords[1]
+        lines.append(f'G1 X{x:.3f} Y{y:.3f} F{self.feed_rate:g}')
+        lines.extend(f'G1 X{x:.3f} Y{y:.3f}' for x, y in coords[2:])
+        lines.append(self.pen_up)
+        self._file.write('\n'.join(lines) + '\n')
+        self.count += 1
+
+
+class HPGLWriter(PlotterWriter):
+    '''HPGL: integer plotter units (40 per millimeter), pen velocity from the feed rate, PU/PD pen commands'''
+
+    def write_header(self):
+        # VS takes centimeters per second, the feed rate is millimeters per minute
+        self._file.write(f'IN;SP1;VS{self.feed_rate / 600:.1f};PU;\n')
+
+    def write_footer(self):
+        self._file.write('PU0,0;SP0;\n')
+
+    def write(self, points):
+        if len(points) < 2:
+            return
+        coords = np.rint(self.to_plotter(points) * HPGL_UNITS).astype(np.int64).tolist()
+        pen_down = ','.join(f'{x},{y}' for x, y in coords[1:])
+        self._file.write(f'PU{coords[0][0]},{coords[0][1]};PD{pen_down};\n')
+        self.count += 1
+
+
+def writer_for(filename):
+    '''exporter class for a file name, None for SVG'''
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in GCODE_EXTENSIONS:
+        return GcodeWriter
+    if extension in HPGL_EXTENSIONS:
+        return HPGLWriter
+    return None
+
+
+def export(paths, filename, imageshape, **settings):
+    '''stream an iterable of (n, 2) pixel coordinate polylines to a G-code or HPGL file, returns the number of strokes'''
+    writer = writer_for(filename)
+    if writer is None:
+        raise ValueError(f'no plotter format for "{filename}"')
+    with writer(filename, imageshape, **settings) as out:
+        out.write_all(paths)
+    return out.count
@@ -0,0 +1,130 @@
+import numpy as np
+import scipy.fft
+from scipy import ndimage
+from scipy.signal import lfilter, lfilter_zi
+from skimage.filters import gaussian as skimage_gaussian
+from skimage.util import img_as_float
+from structure_tensor import structure_tensor_2d
+
+# skimage: scipy.ndimage convolution, exact but its cost grows with sigma
+# iir: recursive Young - van Vliet filter, constant cost per pixel, approximate
+# fft: convolution with the same truncated kernel as scipy.ndimage through the FFT
+BACKENDS = ('skimage', 'iir', 'fft')
+# scipy.ndimage and scikit-image truncate the kernel at this many sigmas
+TRUNCATE = 4.0
+# axes up to this length (the u/v axis of a vector field) are blurred with a small matrix
+SHORT_AXIS = 16
+# below this sigma the recursive filter is least accurate (unit variance noise, sigma 1:
+# 0.46 off, sigma 3: 0.07), while the direct kernel has at most 25 taps and is cheap
+MIN_IIR_SIGMA = 3.0
+
+
+def kernel_radius(sigma):
+    return int(TRUNCATE * float(sigma) + 0.5)
+
+
+def gaussian_kernel(sigma, dtype=np.float64):
+    '''the normalized truncated kernel of scipy.ndimage.gaussian_filter1d'''
+    radius = kernel_radius(sigma)
+    x = np.arange(-radius, radius + 1)
+    weights = np.exp(-0.5 * (x / float(sigma)) ** 2)
+    return (weights / weights.sum()).astype(dtype)
+
+
+def short_axis_gaussian(img, sigma, axis):
+    '''blur along a short axis as a product with the response matrix of the nearest mode filter'''
+    n = img.shape[axis]
+    matrix = ndimage.gaussian_filter1d(np.eye(n), sigma, axis=0, mode='nearest', truncate=TRUNCATE)
+    return np.moveaxis(np.tensordot(matrix.astype(img.dtype), img, axes=(1, axis)), 0, axis)
+
+
+def iir_coefficients(sigma):
+    '''(b, a) of the third order recursive gaussian of Young, van Vliet and van Ginkel (2002),
+    forward and backward pass together have exactly the variance sigma**2'''
+    m0, m1, m2 = 1.16680, 1.10783, 1.40586
+    q = 1.31564 * (np.sqrt(1 + 0.490811 * sigma ** 2) - 1)
+    scale = (m0 + q) * (m1 ** 2 + m2 ** 2 + 2 * m1 * q + q ** 2)
+    b1 = -q * (2 * m0 * m1 + m1 ** 2 + m2 ** 2 + (2 * m0 + 4 * m1) * q + 3 * q ** 2) / scale
+    b2 = q ** 2 * (m0 + 2 * m1 + 3 * q) / scale
+    b3 = -q ** 3 / scale
+    return np.array([1 + b1 + b2 + b3]), np.array([1, b1, b2, b3])
+
+
+def iir_gaussian(img, sigma, axis):
+    '''causal and anticausal pass of the recursive filter with nearest edges: the causal pass
+    starts in the steady state of the first value, the image is extended by the kernel
+    radius at the end so that the causal response has settled where the anticausal starts'''
+    n = img.shape[axis]
+    b, a = iir_coefficients(sigma)
+    b, a = b.astype(img.dtype), a.astype(img.dtype)
+    zi = np.expand_dims(lfilter_zi(b, a).astype(img.dtype), tuple(
+        i for i in range(img.ndim) if i != axis))
+    pad = [(0, 0)] * img.ndim
+    pad[axis] = (0, kernel_radius(sigma))
+    padded = np.pad(img, pad, mode='edge')
+    first = np.take(img, [0], axis=axis)
+    forward = lfilter(b, a, padded, axis=axis, zi=zi * first)[0]
+    last = np.take(forward, [-1], axis=axis)
+    backward = lfilter(b, a, np.flip(forward, axis), axis=axis, zi=zi * last)[0]
+    return np.take(np.flip(backward, axis), np.arange(n), axis=axis)
+
+
+def fft_gaussian(img, sigma, axis):
+    '''convolution with the truncated kernel by FFT, the edge padding by the kernel radius
+    keeps the circular convolution from wrapping around'''
+    n = img.shape[axis]
+    radius = kernel_radius(sigma)
+    size = scipy.fft.next_fast_len(n + 2 * radius, real=True)
+    pad = [(0, 0)] * img.ndim
+    pad[axis] = (radius, radius)
+    padded = np.pad(img, pad, mode='edge')
+    weights = gaussian_kernel(sigma, img.dtype)
+    response = np.zeros(size, img.dtype)
+    response[:radius + 1] = weights[radius:]
+    if radius:
+        response[-radius:] = weights[:radius]
+    shape = [1] * img.ndim
+    shape[axis] = -1
+    spectrum = scipy.fft.rfft(padded, size, axis=axis)
+    spectrum *= scipy.fft.rfft(response).reshape(shape)
+    result = scipy.fft.irfft(spectrum, size, axis=axis)
+    return np.take(result, np.arange(radius, radius + n), axis=axis)
+
+
+def gaussian(img, sigma, backend='skimage'):
+    '''gaussian blur along all axes with nearest edge mode, scikit-image's gaussian computed
+    with the given backend. Float arrays keep their dtype'''
+    if backend not in BACKENDS:
+        raise ValueError(f'unknown blur backend "{backend}", use one of {", ".join(BACKENDS)}')
+    if backend == 'skimage' or sigma == 0:
+        return skimage_gaussian(img, sigma=sigma)
+    result = img_as_float(img)
+    for axis in range(result.ndim):
+        if result.shape[axis] <= SHORT_AXIS:
+            result = short_axis_gaussian(result, sigma, axis)
+        elif backend == 'iir' and sigma >= MIN_IIR_SIGMA:
+            result = iir_gaussian(result, sigma, axis)
+        elif backend == 'iir':
+            result = ndimage.gaussian_filter1d(result, sigma, axis=axis, mode='nearest', truncate=TRUNCATE)
+        else:
+            result = fft_gaussian(result, sigma, axis)
+    return result
+
+
+def structure_tensor(image, sigma, rho, backend='skimage'):
+    '''structure_tensor_2d with the integration (rho) blurs computed by the backend, the
+    derivative of gaussian filters (small sigma) always use scipy.ndimage'''
+    if backend == 'skimage':
+        return structure_tensor_2d(image, sigma, rho)
+    Ix = ndimage.gaussian_filter(image, sigma, order=(1, 0), mode='nearest', truncate=TRUNCATE)
+    Iy = ndimage.gaussian_filter(image, sigma, order=(0, 1), mode='nearest', truncate=TRUNCATE)
+    S = np.empty((3,) + image.shape, dtype=image.dtype)
+    S[0] = gaussian(Ix * Ix, rho, backend)
+    S[1] = gaussian(Iy * Iy, rho, backend)
+    S[2] = gaussian(Ix * Iy, rho, backend)
+    return S
+
+
+def max_error(img, sigma, backend):
+    '''largest absolute difference between the backend and scikit-image's gaussian'''
+    return float(np.max(np.abs(gaussian(img, sigma, backend) - skimage_gaussian(img, sigma=sigma))))
@@ -0,0 +1,59 @@
+from functools import lru_cache
+import numpy as np
+
+NOISE_SEED = 28032005
+
+
+@lru_cache(maxsize=4)
+def noise_texture(shape, seed=NOISE_SEED):
+    '''white noise the streamlines are convolved with, cached per display shape (read only)'''
+    noise = np.random.default_rng(seed).random(shape, dtype=np.float32)
+    noise.flags.writeable = False
+    return noise
+
+
+def resample(field, shape):
+    '''nearest neighbour resampling of a direction field to the display shape, averaging
+    would cancel the arbitrarily signed eigenvectors'''
+    rows = np.minimum(((np.arange(shape[0]) + 0.5) * field.shape[0] / shape[0]).astype(np.intp), field.shape[0] - 1)
+    cols = np.minimum(((np.arange(shape[1]) + 0.5) * field.shape[1] / shape[1]).astype(np.intp), field.shape[1] - 1)
+    return np.asarray(field[np.ix_(rows, cols)], dtype=np.float32)
+
+
+def normalize(image):
+    low, high = image.min(), image.max()
+    return (image - low) / (high - low) if high > low else np.zeros_like(image)
+
+
+def iter_lic(u, v, length, noise, passes=3, cancelled=None):
+    '''progressive line integral convolution of the direction field (u along axis 0, v along
+    axis 1, the convention of the lic package) with a noise texture of the same shape
+
+    all pixels are advected together, one pixel step per iteration in both directions along
+    the field. Steps follow the previous direction, so sign flips of the eigenvectors do not
+    fold a streamline back onto itself. Yields the normalized image after each of passes
+    equal shares of the length/2 steps per direction, stops early once cancelled() is true'''
+    h, w = noise.shape
+    half = max(1, int(length) // 2)
+    checkpoints = set(np.linspace(half / passes, half, passes).round().astype(int).tolist())
+    total = np.array(noise, dtype=np.float32)
+    rows, cols = np.mgrid[0:h, 0:w].astype(np.float32)
+    streams = [[rows, cols, u, v], [rows.copy(), cols.copy(), -u, -v]]
+    for step in range(1, half + 1):
+        if cancelled is not None and cancelled():
+            return
+        for stream in streams:
+            pos_r, pos_c, prev_r, prev_c = stream
+            i = np.clip(np.rint(pos_r), 0, h - 1).astype(np.intp)
+            j = np.clip(np.rint(pos_c), 0, w - 1).astype(np.intp)
+            du, dv = u[i, j], v[i, j]
+            sign = np.where(du * prev_r + dv * prev_c < 0, -1, 1).astype(np.float32)
+            du *= sign
+            dv *= sign
+            pos_r += du
+            pos_c += dv
+            stream[2], stream[3] = du, dv
+            total += noise[np.clip(np.rint(pos_r), 0, h - 1).astype(np.intp),
+                           np.clip(np.rint(pos_c), 0, w - 1).astype(np.intp)]
+        if step in checkpoints:
+            yield normalize(total)
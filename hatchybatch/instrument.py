@@ -0,0 +1,133 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+
+logger = logging.getLogger('hatchybatch')
+
+
+def array_info(value):
+    '''shape, dtype and size of an array (or the summed size of a list of arrays)'''
+    if isinstance(value, np.ndarray):
+        return {'shape': list(value.shape), 'dtype': str(value.dtype), 'nbytes': int(value.nbytes)}
+    if isinstance(value, (list, tuple)) and value and all(isinstance(v, np.ndarray) for v in value):
+        return {'count': len(value), 'shape': list(value[0].shape), 'dtype': str(value[0].dtype),
+                'nbytes': int(sum(v.nbytes for v in value))}
+    return None
+
+
+class Recorder():
+    '''records one event per instrumented stage: wall and CPU time, peak allocated memory
+    (tracemalloc, if trace_memory), array sizes and stage specific counts
+
+    tracemalloc slows down allocation heavy python code considerably (the tracer loops and
+    the path ordering run several times slower), so memory tracing is off by default
+
+    listeners are called with ('start' | 'end', event) from the thread running the stage,
+    current is the name of the running stage (None when idle)'''
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.events = []
+        self.listeners = []
+        self.current = None
+        self.current_start = None
+        self.origin = time.perf_counter()
+        self._started_tracing = False
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self.events = []
+            self.origin = time.perf_counter()
+
+    def notify(self, phase, event):
+        for listener in self.listeners:
+            try:
+                listener(phase, event)
+            except Exception:
+                logger.exception('instrumentation listener failed')
+
+    @contextmanager
+    def stage(self, name, category='stage'):
+        '''context manager recording the enclosed code as one event, the yielded event's
+        args dict can be extended with details'''
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        elif not self.trace_memory and self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        memory_start = tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        event = {'name': name, 'category': category, 'thread': threading.get_ident(),
+                 'start': time.perf_counter() - self.origin, 'args': {}}
+        self.current, self.current_start = name, time.perf_counter()
+        self.notify('start', event)
+        cpu_start = time.process_time()
+        try:
+            yield event
+        except Exception as e:
+            event['args']['error'] = repr(e)
+            logger.exception(f'stage {name} failed')
+            raise
+        finally:
+            event['wall'] = time.perf_counter() - self.origin - event['start']
+            event['cpu'] = time.process_time() - cpu_start
+            if self.trace_memory:
+                event['peak_bytes'] = max(0, tracemalloc.get_traced_memory()[1] - memory_start)
+            self.current = None
+            with self._lock:
+                self.events.append(event)
+            logger.info(f'{category}.{name}: {event["wall"]:.3f}s wall, {event["cpu"]:.3f}s cpu'
+                        + (f', {event["peak_bytes"] / 2**20:.1f} MiB peak' if self.trace_memory else ''))
+            self.notify('end', event)
+
+    def summary(self):
+        '''one line per recorded stage'''
+        return '\n'.join(
+            f'{e["category"]}.{e["name"]:<16} {e["wall"]:8.3f}s wall {e["cpu"]:8.3f}s cpu'
+            + (f' {e["peak_bytes"] / 2**20:8.1f} MiB' if 'peak_bytes' in e else '')
+            for e in self.events)
+
+    def chrome_trace(self):
+        '''the events in the Chrome trace event format (chrome://tracing, Perfetto)'''
+        return [{'name': e['name'], 'cat': e['category'], 'ph': 'X', 'pid': os.getpid(),
+                 'tid': e['thread'], 'ts': e['start'] * 1e6, 'dur': e['wall'] * 1e6,
+                 'args': {'cpu': e['cpu'], 'peak_bytes': e.get('peak_bytes'), **e['args']}}
+                for e in self.events]
+
+    def write(self, filename):
+        '''JSON report, a Chrome trace file with the plain stage records under "stages"'''
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': self.chrome_trace(), 'displayTimeUnit': 'ms',
+                       'stages': self.events}, f, indent=1, default=str)
+
+
+def instrumented(name, outputs=(), stats=None):
+    '''method decorator recording the call as a stage on self.recorder (if set), outputs
+    are attribute names whose array sizes are recorded, stats names a method returning
+    additional counts'''
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            recorder = getattr(self, 'recorder', None)
+            if recorder is None:
+                return method(self, *args, **kwargs)
+            with recorder.stage(name, type(self).__name__) as event:
+                result = method(self, *args, **kwargs)
+                for attribute in outputs:
+                    info = array_info(getattr(self, attribute, None))
+                    if info is not None:
+                        event['args'][attribute] = info
+                if stats is not None:
+                    event['args'].update(getattr(self, stats)())
+            return result
+        return wrapper
+    return decorate
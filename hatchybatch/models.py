@@ -1,36 +1,200 @@
 import numpy as np
 import lic
-import random
 import json
-from svgpathtools import Path, Line, parse_path, disvg, wsvg
-from structure_tensor import eig_special_2d, structure_tensor_2d
-from skimage.filters import gaussian
-from skimage.util import invert
+from collections import deque
+from math import ceil, floor, hypot
+from structure_tensor import eig_special_2d
 from skimage.feature import canny
 from skimage.io import imread
 from skimage.transform import rescale
-from skimage.morphology import dilation
+from hatchybatch.cache import BlurCache
+from hatchybatch.pipeline import StageGraph
+from hatchybatch.export import export, writer_for
+from hatchybatch.filters import BACKENDS, gaussian, structure_tensor
+from hatchybatch.flowvis import iter_lic, noise_texture, resample
+from hatchybatch.instrument import instrumented
+from hatchybatch.ordering import optimize_order
+from hatchybatch.paths import PathStore, HATCH, CROSSHATCH, CONTOUR, point_along, rotate
 
 
 class ImageData():
-    ''' the image data model'''
+    ''' the image data model
+
+    the stages form a graph of memoized nodes (see build_graph), every generate_* call
+    stores its parameters in self.params and only recomputes the stale nodes. With a
+    disk_cache the source, blurs, edge map, flow fields and LIC of a loaded image file are
+    also stored on disk, keyed by the image digest and the stage parameters.
+
+    dtype is the floating point type of the source and of every float stage (blurs, XDoG
+    ramp, structure tensor, flow fields, LIC). float32 halves memory and bandwidth, the
+    results differ from float64 by rounding only: the XDoG and threshold masks flip the
+    few pixels whose value lies within float32 precision of a threshold (about 3e-5 of the
+    pixels), canny edges can differ at its hysteresis thresholds and the flow field
+    directions differ by about 1e-7 (up to 1e-3 in flat regions with nearly equal
+    eigenvalues). Traced strokes follow the same fields but can stop or bounce at different
+    steps, so the path count changes by about a percent. The tracers accumulate positions in
+    float64 regardless of the field dtype.
+
+    blur_backend computes the blurs, the structure tensor integration and the hatch field
+    smoothing (see hatchybatch.filters): 'skimage' (default, cost grows with sigma), 'fft'
+    (same result up to rounding, constant cost) or 'iir' (recursive approximation, constant
+    cost, deviates by up to about 3% of the value range)'''
     MAX_SIZE = 1024
+    # longest side of the fast flow field visualization
+    LIC_PREVIEW_SIZE = 512
 
-    def __init__(self):
+    def __init__(self, disk_cache=None, recorder=None, dtype=np.float64, blur_backend='skimage'):
         self.source = None
+        self.filename = None
+        self.blur_cache = BlurCache()
+        self.disk_cache = disk_cache
+        self.recorder = recorder
+        self.dtype = np.dtype(dtype)
+        self.params = {'image_digest': None, 'dtype': self.dtype.name}
+        self.workspaces = {}
+        self._lic_preview_key = None
+        self.graph = self.build_graph()
+        self.blur_backend = None
+        self.set_blur_backend(blur_backend)
+
+    def build_graph(self):
+        '''source -> blurs -> XDoG -> thresholds, source -> structure tensor -> flow field -> LIC / hatch field, source -> canny'''
+        graph = StageGraph()
+        graph.add('source', lambda digest, dtype: self.source, ('image_digest', 'dtype'))
+        graph.add('blur_high', lambda source, sigma, backend: self.blur(sigma),
+                  ('xdog_sigma_high', 'blur_backend'), ('source',))
+        graph.add('blur_low', lambda source, sigma, backend: self.blur(sigma),
+                  ('xdog_sigma_low', 'blur_backend'), ('source',))
+        graph.add('unsharp_mask', self.compute_unsharp_mask,
+                  ('xdog_sharp_p',), ('blur_high', 'blur_low'))
+        graph.add('xdog', self.compute_xdog,
+                  ('xdog_phi', 'xdog_epsilon'), ('unsharp_mask',))
+        graph.add('dog', self.compute_dog,
+                  ('dog_threshold',), ('blur_high', 'blur_low'))
+        graph.add('thresholds', self.threshold_masks,
+                  ('thresh_min_values', 'thresh_max_values'), ('source', 'xdog'))
+        graph.add('edgemap', canny,
+                  ('edgemap_sigma', 'edgemap_thresh_high', 'edgemap_thresh_low'), ('source',), persistent=True)
+        graph.add('structure_tensor', structure_tensor,
+                  ('flowfield_sigma', 'flowfield_rho', 'blur_backend'), ('source',))
+        graph.add('flowfield', lambda S: eig_special_2d(S)[1],
+                  deps=('structure_tensor',), persistent=True)
+        graph.add('hatchfield', gaussian,
+                  ('flowfield_hatch_sigma', 'blur_backend'), ('flowfield',), persistent=True)
+        graph.add('lic', self.compute_lic, ('lic_length',), ('flowfield',), persistent=True)
+        return graph
+
+    def stage_stats(self):
+        '''hit and miss counts of every stage'''
+        return self.graph.stats()
+
+    def proxy(self, scale):
+        '''downsampled copy of the image data model, used for fast previews'''
+        proxy = ImageData(recorder=self.recorder, dtype=self.dtype, blur_backend=self.blur_backend)
+        proxy.source = rescale(self.source, scale, anti_aliasing=True).astype(self.dtype, copy=False)
+        return proxy
 
     def constant_scale(self, img):
         '''scales the longest side of the image to a fixed value (MAX_SIZE)'''
         scale_factor = self.MAX_SIZE / np.max(img.shape)
         return rescale(img, scale_factor, anti_aliasing=True)
 
+    @instrumented('load_image', ('source',))
     def load_image(self, filename):
         '''loads, scales and converts an image to grayscale for use as the source for the imageData class'''
-        self.source = self.constant_scale(imread(filename, as_gray=True))
-
-    @staticmethod
-    def ramp_threshold(img, phi, epsilon):
-        return np.tanh(np.multiply(phi, np.subtract(img, epsilon)))
+        digest = None
+        if self.disk_cache is not None:
+            with open(filename, 'rb') as f:
+                digest = self.disk_cache.digest(f.read())
+        self.params['image_digest'] = digest
+        self.graph.store = None if digest is None else self.disk_cache
+        self.filename = filename
+        self.source = self.read_source()
+        self.blur_cache.clear()
+        self.graph.invalidate()
+        # without a disk cache the flowfield key does not identify the image
+        self._lic_preview_key = None
+
+    def read_source(self):
+        '''the scaled grayscale image of self.filename in the current dtype, through the disk cache'''
+        return self.persist(('source', self.MAX_SIZE), lambda: self.constant_scale(
+            imread(self.filename, as_gray=True)).astype(self.dtype, copy=False))
+
+    def compute_lic(self, vec, length):
+        '''the lic package computes in float64, its boundary divisions by float32 zeros warn harmlessly'''
+        with np.errstate(divide='ignore'):
+            return lic.lic(vec[0], vec[1], length=length).astype(self.dtype, copy=False)
+
+    def set_dtype(self, dtype):
+        '''switch the precision of all stages, the loaded source is converted to a smaller
+        dtype and read again (from the disk cache or the file) for a larger one, so the
+        float32 rounding never ends up in float64 stages. A source assigned directly is
+        converted either way'''
+        dtype = np.dtype(dtype)
+        if dtype == self.dtype:
+            return
+        widen = dtype.itemsize > self.dtype.itemsize
+        self.dtype = dtype
+        self.params['dtype'] = dtype.name
+        if self.source is not None and widen and self.filename is not None:
+            self.source = self.read_source()
+        elif self.source is not None:
+            self.source = self.source.astype(dtype)
+        self.blur_cache.clear()
+        self._lic_preview_key = None
+
+    def set_blur_backend(self, backend):
+        '''switch the gaussian implementation of all blurring stages'''
+        if backend not in BACKENDS:
+            raise ValueError(f'unknown blur backend "{backend}", use one of {", ".join(BACKENDS)}')
+        if backend == self.blur_backend:
+            return
+        self.blur_backend = backend
+        self.params['blur_backend'] = backend
+        self.blur_cache.clear()
+
+    def persist(self, key, compute):
+        '''compute() through the disk cache (keyed by the image digest and dtype) if there is one for the current image'''
+        if self.graph.store is None:
+            return compute()
+        return self.graph.store.get((self.params['image_digest'], self.params['dtype']) + key, compute)
+
+    def blur(self, sigma):
+        '''gaussian blur of the source, shared between all stages through the blur cache'''
+        return self.blur_cache.get(sigma, lambda: self.persist(
+            ('blur', self.blur_backend, float(sigma)), lambda: gaussian(self.source, sigma, self.blur_backend)))
+
+    def workspace(self, name, shape, dtype):
+        '''buffer owned by the model and reused by every recalculation, reallocated when the
+        image size or dtype changes. Only stages run under the graph lock may use them'''
+        buffer = self.workspaces.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = self.workspaces[name] = np.empty(shape, dtype)
+        return buffer
+
+    def compute_unsharp_mask(self, outer, inner, p):
+        '''unsharp mask into the reused "unsharp_mask" workspace, it is the memoized value of
+        the stage until the next recalculation overwrites it'''
+        dtype = np.result_type(outer, inner)
+        return self.unsharp_mask(outer, inner, p, out=self.workspace('unsharp_mask', outer.shape, dtype),
+                                 scratch=self.workspace('scratch', outer.shape, dtype))
+
+    def compute_xdog(self, unsharp_mask, phi, epsilon):
+        '''XDoG ramp and normalization in the scratch workspace, only the uint8 result is allocated'''
+        ramp = self.xdog_ramp(unsharp_mask, phi, epsilon,
+                              out=self.workspace('scratch', unsharp_mask.shape, unsharp_mask.dtype))
+        return self.xdog_normalize(ramp, np.max(ramp), out=ramp)
+
+    def compute_dog(self, outer, inner, threshold):
+        '''DoG in the scratch workspace, only the binary result is allocated'''
+        return self.dog_threshold(outer, inner, threshold,
+                                  out=self.workspace('scratch', outer.shape, np.result_type(outer, inner)),
+                                  mask=self.workspace('mask', outer.shape, bool))
+
+    def evaluate(self, stage, **params):
+        '''update the parameters and return the (possibly memoized) value of a stage'''
+        self.params.update(params)
+        return self.graph.get(stage, self.params)
 
     @staticmethod
     def binarize(ndarr):
@@ -38,79 +202,185 @@ class ImageData():
         ndarr[ndarr < 0] = 0
         return ndarr
 
+    @staticmethod
+    def dog_threshold(outer, inner, threshold, out=None, mask=None):
+        '''binary DoG, out (float) and mask (bool) are optional work buffers of the image size'''
+        if out is None:
+            diff = np.subtract(inner, outer)
+            diff_positive = np.subtract(diff, np.min(diff))
+            relative_diff = np.divide(diff_positive, np.max(diff_positive))
+            return ImageData.binarize(np.subtract(relative_diff, threshold))
+        np.subtract(inner, outer, out=out)
+        np.subtract(out, np.min(out), out=out)
+        np.divide(out, np.max(out), out=out)
+        np.subtract(out, threshold, out=out)
+        return np.greater(out, 0, out=mask).astype(out.dtype)
+
+    @staticmethod
+    def unsharp_mask(outer, inner, p, out=None, scratch=None):
+        '''the operations run in place in out, scratch holds the scaled inner blur (both
+        optional, they must not alias the blurs)'''
+        # Equation 3.7.4 in thesis
+        scaled_inner = np.multiply(p + 1, inner, out=scratch)
+        scaled_dog = np.subtract(scaled_inner, np.multiply(p, outer, out=out), out=out)
+        return np.multiply(np.multiply(outer, scaled_dog, out=out), 255, out=out)
+
+    @staticmethod
+    def xdog_ramp(unsharp_mask, phi, epsilon, out=None):
+        # Equation 3.7.2 in thesis
+        ramp = np.subtract(unsharp_mask, epsilon, out=out)
+        ramp = np.tanh(np.multiply(phi, ramp, out=ramp), out=ramp)
+        return np.multiply(np.add(1, ramp, out=ramp), 255, out=ramp)
+
+    @staticmethod
+    def xdog_normalize(result, maximum, out=None):
+        '''uint8 XDoG, with out the scaling runs in place there (out may be result)'''
+        scaled = np.multiply(np.divide(result, maximum, out=out), 255, out=out)
+        return np.round(scaled, out=scaled).astype('uint8')
+
+    @staticmethod
+    def threshold_masks(source, xdog, thresh_min_values, thresh_max_values):
+        ''' band masks from a single label image
+
+        the source is digitized once against the sorted band edges, a lookup table turns the
+        labels into bit-packed band planes and one cross shaped dilation covers all bands'''
+        thresh_xdog = xdog < 252
+        edges = np.unique(np.concatenate(
+            [thresh_min_values, thresh_max_values]))
+        # label > i  <=>  source > edges[i]
+        labels = np.digitize(source, edges, right=True)
+        lut = np.zeros(len(edges) + 1, dtype=np.uint8 if len(
+            thresh_min_values) <= 8 else np.uint64)
+        label_values = np.arange(len(lut))
+        for band, (min, max) in enumerate(zip(thresh_min_values, thresh_max_values)):
+            low, high = sorted((np.searchsorted(edges, min), np.searchsorted(edges, max)))
+            lut[(label_values > low) & (label_values <= high)] |= lut.dtype.type(1 << band)
+        bits = lut[labels]
+        dilated = bits.copy()
+        dilated[1:] |= bits[:-1]
+        dilated[:-1] |= bits[1:]
+        dilated[:, 1:] |= bits[:, :-1]
+        dilated[:, :-1] |= bits[:, 1:]
+        band_bits = (np.ones(1, dtype=lut.dtype) << np.arange(
+            len(thresh_min_values), dtype=lut.dtype))[:, None, None]
+        planes = np.bitwise_and(dilated, band_bits) != 0
+        xdog_planes = np.bitwise_and(planes, thresh_xdog)
+        return thresh_xdog, list(planes), list(xdog_planes)
+
+    @instrumented('dog', ('dog',))
     def generate_DoG(self, sigma_high, sigma_low, threshold):
         '''Difference of Gaussians simple implementation in numpy and scikit-image'''
-        outer = gaussian(self.source, sigma=sigma_high)
-        inner = gaussian(self.source, sigma=sigma_low)
-        diff = np.subtract(inner, outer)
-        diff_positive = np.subtract(diff, np.min(diff))
-        relative_diff = np.divide(diff_positive, np.max(diff_positive))
-        self.dog = self.binarize(np.subtract(relative_diff, threshold))
+        self.dog = self.evaluate(
+            'dog', xdog_sigma_high=sigma_high, xdog_sigma_low=sigma_low, dog_threshold=threshold)
 
+    @instrumented('xdog', ('xdog',))
     def generate_XDoG(self, sigma_high, sigma_low, p, phi, epsilon):
         ''' XDoG - implementation of Winnemoeller et al. eXtended Difference of Gaussians'''
-        outer = gaussian(self.source, sigma=sigma_high)
-        inner = gaussian(self.source, sigma=sigma_low)
-        # Equation 3.7.4 in thesis
-        scaled_dog = np.subtract(np.multiply(
-            p + 1, inner), np.multiply(p, outer))
-        unsharp_mask = np.multiply(np.multiply(outer, scaled_dog), 255)
-        # Equation 3.7.2 in thesis
-        ramp_tresh = np.add(1, self.ramp_threshold(
-            img=unsharp_mask, phi=phi, epsilon=epsilon))
-        result = np.multiply(ramp_tresh, 255)
-        self.xdog = np.round(np.multiply(
-            np.divide(result, np.max(result)), 255)).astype('uint8')
+        self.xdog = self.evaluate(
+            'xdog', xdog_sigma_high=sigma_high, xdog_sigma_low=sigma_low,
+            xdog_sharp_p=p, xdog_phi=phi, xdog_epsilon=epsilon)
 
+    @instrumented('edgemap', ('edgemap',))
     def generate_edge_map(self, sigma, thresh_high, thresh_low):
         ''' simple canny edge detection with the GUI supplied parameters'''
-        self.edgemap = canny(self.source, sigma, thresh_high, thresh_low)
+        self.edgemap = self.evaluate(
+            'edgemap', edgemap_sigma=sigma, edgemap_thresh_high=thresh_high, edgemap_thresh_low=thresh_low)
 
+    @instrumented('flowfield', ('flowfield_u', 'flowfield_v', 'flowfield_hatch_u', 'flowfield_hatch_v'))
     def generate_flow_field(self, sigma, rho, hatchsigma):
         '''edge tangent flow field derived by the eigenvectors of the structure tensor'''
-        S = structure_tensor_2d(self.source, sigma, rho)
-        val, vec = eig_special_2d(S)
-        hatchfield = gaussian(vec, sigma=hatchsigma)
+        self.params.update(flowfield_sigma=sigma, flowfield_rho=rho,
+                           flowfield_hatch_sigma=hatchsigma)
+        vec = self.graph.get('flowfield', self.params)
+        hatchfield = self.graph.get('hatchfield', self.params)
         self.flowfield_u = vec[0]
         self.flowfield_v = vec[1]
         self.flowfield_hatch_u = hatchfield[0]
         self.flowfield_hatch_v = hatchfield[1]
 
+    @instrumented('lic', ('lic',))
     def generate_lic(self, stroke_length=20):
         ''' line integral convolution used to visualize the vector field in the GUI'''
-        self.lic = lic.lic(
-            self.flowfield_u, self.flowfield_v, length=stroke_length)
-
+        self.lic = self.evaluate('lic', lic_length=stroke_length)
+
+    @instrumented('lic_preview', ('lic_preview',))
+    def generate_lic_preview(self, stroke_length=20, size=None, passes=3, cancelled=None, on_pass=None):
+        ''' fast line integral convolution of the flow field at display resolution (longest
+        side size), refined over passes; on_pass(image) is called with every refinement.
+        Returns the final image, or the last finished pass (None before the first) if
+        cancelled() became true. generate_lic computes the full quality version'''
+        size = size or self.LIC_PREVIEW_SIZE
+        key = (self.graph.key('flowfield', self.params), stroke_length, size, passes)
+        if key == self._lic_preview_key:
+            if on_pass is not None:
+                on_pass(self.lic_preview)
+            return self.lic_preview
+        vec = self.graph.get('flowfield', self.params)
+        scale = min(1.0, size / max(vec.shape[1:]))
+        shape = tuple(max(1, round(n * scale)) for n in vec.shape[1:])
+        image = None
+        finished = 0
+        for image in iter_lic(resample(vec[0], shape), resample(vec[1], shape),
+                              stroke_length * scale, noise_texture(shape), passes, cancelled):
+            self.lic_preview = image
+            finished += 1
+            if on_pass is not None:
+                on_pass(image)
+        if finished == passes:
+            self._lic_preview_key = key
+        return image
+
+    @instrumented('thresholds', ('thresholds', 'xdog_thresholds'))
     def generate_thresholds(self, thresh_min_values, thresh_max_values):
         ''' threshold masks from the image '''
-        self.thresh_xdog = self.xdog < 252
-        self.thresholds = []
-        self.xdog_thresholds = []
-        for min, max in zip(thresh_min_values, thresh_max_values):
-            thresh_min = self.source > min
-            thresh_min = invert(thresh_min)
-            thresh_max = self.source > max
-            thresh_max = invert(thresh_max)
-            thresh = dilation(np.bitwise_xor(thresh_min, thresh_max))
-            self.thresholds.append(thresh)
-            self.xdog_thresholds.append(
-                np.bitwise_and(self.thresholds[-1], self.thresh_xdog))
+        self.thresh_xdog, self.thresholds, self.xdog_thresholds = self.evaluate(
+            'thresholds', thresh_min_values=tuple(thresh_min_values),
+            thresh_max_values=tuple(thresh_max_values))
 
 
 class Tracer():
-    '''model class for the path generation'''
-
-    def __init__(self, imageshape, edgemap, thresholds, u, v, hatch_u, hatch_v):
-        self._paths = []
-        self.imageshape = imageshape
-        self.edgemap = np.transpose(np.nonzero(edgemap > 0))
-        self.hatchmaps = thresholds
+    '''model class for the path generation
+
+    all random choices (stroke lengths, crosshatch angles and pivots, contour selection and
+    extents) come from one numpy Generator per band and one for the contours, derived from
+    seed. They are drawn as arrays indexed by seed point (or edge pixel) before tracing, so
+    the output only depends on the seed and the settings: the loop, vectorized and parallel
+    (hatchybatch.parallel) tracing give identical paths'''
+    ENGINES = ('loop', 'vectorized')
+    # crosshatch strokes are rotated around a point at one of these fractions of the stroke
+    PIVOTS = (0.3, 0.4, 0.5, 0.6, 0.7)
+    # pentips traced together by the vectorized engine, bounds the size of the trail buffer
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, imageshape, edgemap, thresholds, u, v, hatch_u, hatch_v, seed=0):
+        pixels = np.transpose(np.nonzero(
+            edgemap if edgemap.dtype == bool else edgemap > 0))
         self.u = u
         self.v = v
+        # field orientation is only needed at the edge pixels
+        self.rads = np.arctan2(u[pixels[:, 0], pixels[:, 1]], v[pixels[:, 0], pixels[:, 1]])
+        self.set_fields(imageshape, pixels, np.divide(np.multiply(self.rads, 180), np.pi),
+                        thresholds, hatch_u, hatch_v, seed)
+
+    @classmethod
+    def from_fields(cls, imageshape, pixels, degrees, thresholds, hatch_u, hatch_v, seed=0):
+        '''tracer on precomputed edge pixels ((n, 2) row, column) and their field orientation
+        in degrees, without the u, v flow field (see hatchybatch.parallel)'''
+        tracer = cls.__new__(cls)
+        tracer.set_fields(imageshape, pixels, degrees, thresholds, hatch_u, hatch_v, seed)
+        return tracer
+
+    def set_fields(self, imageshape, pixels, degrees, thresholds, hatch_u, hatch_v, seed=0):
+        self._paths = PathStore()
+        self.imageshape = imageshape
+        self.edgemap = pixels
+        self.degrees = degrees
+        self.hatchmaps = thresholds
         self.hatch_u = hatch_u
         self.hatch_v = hatch_v
-        self.rads = np.arctan2(u, v)
-        self.degrees = np.divide(np.multiply(self.rads, 180), np.pi)
+        self.seed = seed
+        self.seed_counts = [0] * len(thresholds)
+        self.recorder = None
 
     @ staticmethod
     def check_bounce(pentip):
@@ -135,71 +405,427 @@ class Tracer():
         pos_y = np.floor(pentip.pos[1]).astype(int)
         return [self.hatch_u[pos_x][pos_y], self.hatch_v[pos_x][pos_y]]
 
+    def stream(self, band):
+        '''random generator of a band, band -1 is the contour stream'''
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(band + 1,)))
+
+    def stroke_draws(self, rng, count, path_length):
+        '''(lengths, crosshatch angles, crosshatch pivots) of count strokes'''
+        return (rng.integers(path_length - 3, path_length + 3, size=count, endpoint=True),
+                rng.integers(70, 110, size=count, endpoint=True),
+                rng.choice(self.PIVOTS, size=count))
+
+    def contour_draws(self, path_length, probability):
+        '''(selected, left extent, right extent) of every edge pixel'''
+        rng = self.stream(-1)
+        count = len(self.edgemap)
+        return (rng.random(count) < probability,
+                rng.integers(1, path_length, size=count, endpoint=True),
+                rng.integers(1, path_length, size=count, endpoint=True))
+
     def generate_seed_points(self, threshmask, distance):
         '''generate starting points for the pentips'''
-        seedpoints = np.zeros(self.imageshape, dtype=bool)
-        seedpoints[0::distance, 0::distance] = True
-        seedpoints = np.bitwise_and(seedpoints, threshmask)
-        return np.transpose(np.nonzero(seedpoints > 0))
+        grid = np.asarray(threshmask[0::distance, 0::distance])
+        return np.transpose(np.nonzero(grid)) * distance
+
+    @instrumented('hatchpaths', stats='band_stats')
+    def generate_hatchpaths(self, path_lengths, distances, crosshatch, engine='vectorized'):
+        ''' the algorithm for hatching paths generation
 
-    def generate_hatchpaths(self, path_lengths, distances, crosshatch):
-        ''' the algorithm for hatching paths generation'''
+        engine "loop" follows one pentip at a time, "vectorized" advances all pentips of a band in lockstep'''
+        if engine not in self.ENGINES:
+            raise ValueError(f'unknown tracing engine "{engine}"')
         for idx, hatchmap in enumerate(self.hatchmaps):
             seed_points = self.generate_seed_points(hatchmap, distances[idx])
-            for startpoint in seed_points:
-                path = Path()
-                pentip = Pentip(startpoint[0], startpoint[1])
-                for i in range(0, random.randint(path_lengths[idx]-3, path_lengths[idx]+3)):
-                    if self.check_imagebounds(pentip, self.imageshape):
-                        pentip.dir = self.get_next_direction(pentip)
-                        if self.check_bounce(pentip):
-                            break
-                        pentip.pdir = pentip.dir.copy()
-                        pentip.ppos = pentip.pos.copy()
-                        pentip.pos = np.add(pentip.pos, pentip.dir)
-                        path.append(
-                            Line(complex(pentip.ppos[1], pentip.ppos[0]), complex(pentip.pos[1], pentip.pos[0])))
-                    if not self.check_edgebounds(pentip, hatchmap):
+            self.seed_counts[idx] += len(seed_points)
+            draws = self.stroke_draws(self.stream(idx), len(seed_points), path_lengths[idx])
+            if engine == 'loop':
+                self.trace_band_loop(idx, hatchmap, seed_points, draws, crosshatch[idx])
+            else:
+                self.trace_band_vectorized(idx, hatchmap, seed_points, draws, crosshatch[idx])
+
+    @instrumented('even_hatchpaths', stats='band_stats')
+    def generate_even_hatchpaths(self, path_lengths, distances, crosshatch, test_ratio=0.5):
+        ''' evenly spaced hatching in the style of Jobard and Lefer
+
+        the band distance is the separating distance: new seeds are placed at that distance
+        beside finished strokes (grid seed points fill the remaining regions) and are only used
+        if no stroke is closer, pentips stop once they come closer than test_ratio * distance
+        to another stroke. Strokes are kept in a per band occupancy grid'''
+        for idx, hatchmap in enumerate(self.hatchmaps):
+            self.trace_band_even(
+                idx, hatchmap, path_lengths[idx], distances[idx], crosshatch[idx], test_ratio)
+
+    def trace_band_even(self, band, hatchmap, path_length, separation, crosshatch, test_ratio=0.5):
+        ''' evenly spaced strokes of one band, the bands do not share their occupancy grids
+
+        the candidate seeds depend on the strokes traced before, so the random values are
+        drawn from the band stream one seed at a time'''
+        rng = self.stream(band)
+        grid = OccupancyGrid(self.imageshape, separation)
+        fallback = deque(map(tuple, self.generate_seed_points(
+            hatchmap, max(1, int(separation))).astype(float)))
+        seeds = deque()
+        while seeds or fallback:
+            seed = seeds.popleft() if seeds else fallback.popleft()
+            if not (0 < seed[0] < self.imageshape[0] and 0 < seed[1] < self.imageshape[1]):
+                continue
+            if not hatchmap[int(seed[0]), int(seed[1])] or not grid.is_free(seed, separation * 0.99):
+                continue
+            length, degrees, pivot = (draw[0] for draw in self.stroke_draws(rng, 1, path_length))
+            points = self.trace_streamline(
+                seed, hatchmap, length, grid, separation * test_ratio)
+            self.seed_counts[band] += 1
+            if len(points) > 2:
+                grid.add(points)
+                seeds.extend(self.side_seeds(points, separation))
+                self.append_hatchpath(
+                    np.array(points)[:, ::-1], band, crosshatch, degrees, pivot)
+
+    def trace_streamline(self, seed, hatchmap, length, grid, test_distance):
+        ''' follow the vector field from seed for at most length steps with the stopping rules
+        of the loop engine, additionally stopping when another stroke is closer than test_distance'''
+        pos_x, pos_y = seed
+        pdir_x = pdir_y = 0.0
+        points = [seed]
+        for i in range(0, length):
+            if not (0 < pos_x < self.imageshape[0] and 0 < pos_y < self.imageshape[1]):
+                break
+            dir_x = float(self.hatch_u[int(pos_x), int(pos_y)])
+            dir_y = float(self.hatch_v[int(pos_x), int(pos_y)])
+            if round(dir_x, 1) == round(-pdir_x, 1) or round(dir_y, 1) == round(-pdir_y, 1):
+                break
+            if not grid.is_free((pos_x + dir_x, pos_y + dir_y), test_distance):
+                break
+            pdir_x, pdir_y = dir_x, dir_y
+            pos_x, pos_y = pos_x + dir_x, pos_y + dir_y
+            points.append((pos_x, pos_y))
+            if not hatchmap[floor(pos_x) - 1, floor(pos_y) - 1]:
+                break
+        return points
+
+    @staticmethod
+    def side_seeds(points, separation):
+        ''' candidate seeds at the separating distance on both sides of a stroke'''
+        seeds = []
+        for (ax, ay), (bx, by) in zip(points[:-1], points[1:]):
+            length = hypot(bx - ax, by - ay)
+            if length == 0:
+                continue
+            normal_x = -(by - ay) / length * separation
+            normal_y = (bx - ax) / length * separation
+            seeds.append((ax + normal_x, ay + normal_y))
+            seeds.append((ax - normal_x, ay - normal_y))
+        return seeds
+
+    def trace_band_loop(self, band, hatchmap, seed_points, draws, crosshatch):
+        ''' follow the vector field with one pentip per seed point, draws are the stroke_draws
+        of the seed points'''
+        for startpoint, length, degrees, pivot in zip(seed_points, *draws):
+            pentip = Pentip(startpoint[0], startpoint[1])
+            points = [(pentip.pos[1], pentip.pos[0])]
+            for i in range(0, length):
+                if self.check_imagebounds(pentip, self.imageshape):
+                    pentip.dir = self.get_next_direction(pentip)
+                    if self.check_bounce(pentip):
                         break
-                if len(path._segments) > 1:
-                    self._paths.append(path)
-                    if crosshatch[idx]:
-                        self._paths.append(
-                            path.rotated(random.randint(70, 110), path.point(random.choice([0.3, 0.4, 0.5, 0.6, 0.7]))))
-
-    def generate_contours(self, path_length, probability):
-        ''' the algorithm for the edge paths generation'''
-        for idx, pixel in enumerate(self.edgemap):
-            if random.random() < probability:
+                    pentip.pdir = pentip.dir.copy()
+                    pentip.ppos = pentip.pos.copy()
+                    pentip.pos = np.add(pentip.pos, pentip.dir)
+                    points.append((pentip.pos[1], pentip.pos[0]))
+                if not self.check_edgebounds(pentip, hatchmap):
+                    break
+            if len(points) > 2:
+                self.append_hatchpath(np.array(points), band, crosshatch, degrees, pivot)
+
+    def trace_band_vectorized(self, band, hatchmap, seed_points, draws, crosshatch):
+        ''' follow the vector field with all pentips of a band at once
+
+        positions and directions are (n, 2) arrays, pentips that hit a stopping rule
+        (image bounds, bounce, leaving the hatchmap, random length) are masked out'''
+        for start in range(0, len(seed_points), self.CHUNK_SIZE):
+            self.trace_chunk_vectorized(
+                band, hatchmap, seed_points[start:start + self.CHUNK_SIZE],
+                [draw[start:start + self.CHUNK_SIZE] for draw in draws], crosshatch)
+
+    def trace_chunk_vectorized(self, band, hatchmap, seed_points, draws, crosshatch):
+        lengths, angles, pivots = draws
+        count = len(seed_points)
+        max_steps = max(int(lengths.max()), 0) if count else 0
+        pos = seed_points.astype(np.float64)
+        # directions in the field dtype, the bounce test rounds them like the loop engine
+        pdir = np.zeros((count, 2), dtype=np.result_type(self.hatch_u, self.hatch_v))
+        steps = np.zeros(count, dtype=int)
+        alive = np.ones(count, dtype=bool)
+        trail = np.empty((max_steps + 1, count, 2))
+        trail[0] = pos
+        for step in range(max_steps):
+            alive &= step < lengths
+            # a pentip outside the image never moves again, so it is done
+            alive &= (pos[:, 0] > 0) & (pos[:, 0] < self.imageshape[0]) & (
+                pos[:, 1] > 0) & (pos[:, 1] < self.imageshape[1])
+            active = np.flatnonzero(alive)
+            if active.size == 0:
+                break
+            cell = np.floor(pos[active]).astype(int)
+            direction = np.stack(
+                (self.hatch_u[cell[:, 0], cell[:, 1]], self.hatch_v[cell[:, 0], cell[:, 1]]), axis=1)
+            bounce = (np.round(direction[:, 0], decimals=1) == np.round(-pdir[active, 0], decimals=1)) | (
+                np.round(direction[:, 1], decimals=1) == np.round(-pdir[active, 1], decimals=1))
+            alive[active[bounce]] = False
+            moving = active[~bounce]
+            pdir[moving] = direction[~bounce]
+            pos[moving] += direction[~bounce]
+            steps[moving] += 1
+            trail[step + 1, moving] = pos[moving]
+            cell = np.floor(pos[moving]).astype(int)
+            alive[moving] &= hatchmap[cell[:, 0] - 1, cell[:, 1] - 1]
+        for idx in np.flatnonzero(steps > 1):
+            self.append_hatchpath(
+                trail[:steps[idx] + 1, idx, ::-1], band, crosshatch, angles[idx], pivots[idx])
+
+    def append_hatchpath(self, points, band, crosshatch, degrees, pivot):
+        ''' add a traced (n, 2) x, y polyline to the output, with a copy rotated by degrees
+        around the point at the pivot fraction of its length if crosshatching is enabled'''
+        self._paths.append(points, band, HATCH)
+        if crosshatch:
+            self._paths.append(
+                rotate(points, degrees, point_along(points, pivot)), band, CROSSHATCH)
+
+    @instrumented('contours', stats='band_stats')
+    def generate_contours(self, path_length, probability, engine='vectorized'):
+        ''' the algorithm for the edge paths generation
+
+        engine "loop" handles one edge pixel at a time, "vectorized" draws the probability mask,
+        the random extents and the rotated endpoints for all edge pixels at once'''
+        if engine not in self.ENGINES:
+            raise ValueError(f'unknown tracing engine "{engine}"')
+        draws = self.contour_draws(path_length, probability)
+        if engine == 'loop':
+            self.trace_contours_loop(draws)
+        else:
+            self.trace_contours_vectorized(draws)
+
+    def trace_contours_loop(self, draws):
+        ''' contours of the edge pixels with their contour_draws'''
+        for idx, (pixel, selected, left, right) in enumerate(zip(self.edgemap, *draws)):
+            if selected:
                 pt_x = pixel[1]
                 pt_y = pixel[0]
-                path = parse_path(
-                    f'M {pt_x-random.randint(1,path_length)} {pt_y} L {pt_x+random.randint(1,path_length)} {pt_y}')
-                path = path.rotated(self.degrees[pt_y][pt_x])
-                self._paths.append(path)
+                points = np.array([[pt_x-left, pt_y],
+                                   [pt_x+right, pt_y]], dtype=np.float64)
+                self._paths.append(
+                    rotate(points, self.degrees[idx], points.mean(axis=0)), -1, CONTOUR)
+
+    def trace_contours_vectorized(self, draws):
+        selected, left, right = draws
+        pixels = self.edgemap[selected]
+        count = len(pixels)
+        pt_y = pixels[:, 0]
+        pt_x = pixels[:, 1]
+        left = left[selected]
+        right = right[selected]
+        # a horizontal line from x - left to x + right, rotated around its midpoint
+        center_x = pt_x + (right - left) / 2
+        half = (left + right) / 2
+        rads = np.radians(self.degrees[selected])
+        dx = half * np.cos(rads)
+        dy = half * np.sin(rads)
+        points = np.empty((count, 2, 2))
+        points[:, 0, 0] = center_x - dx
+        points[:, 0, 1] = pt_y - dy
+        points[:, 1, 0] = center_x + dx
+        points[:, 1, 1] = pt_y + dy
+        self._paths.extend(points.reshape(-1, 2), np.full(count, 2), -1, CONTOUR)
+
+    @instrumented('simplify')
+    def simplify(self, tolerance):
+        '''simplify all paths to the tolerance in pixels, returns the vertex counts before and after'''
+        before = self._paths.vertex_count
+        self._paths = self._paths.simplify(tolerance)
+        return before, self._paths.vertex_count
+
+    @instrumented('optimize_travel')
+    def optimize_travel(self):
+        '''reorder (and possibly reverse) the paths to shorten the pen-up travel, returns the travel before and after'''
+        self._paths, travel = optimize_order(self._paths)
+        return travel
+
+    def band_stats(self):
+        '''seed, path and segment counts per band, contours are counted separately'''
+        bands = self._paths.bands.astype(np.int64)
+        segments = np.diff(self._paths.offsets) - 1
+        hatch = bands >= 0
+        return {
+            'seeds': list(self.seed_counts),
+            'paths': np.bincount(bands[hatch], minlength=len(self.hatchmaps)).tolist(),
+            'segments': np.bincount(bands[hatch], segments[hatch], len(self.hatchmaps)).astype(np.int64).tolist(),
+            'contour_paths': int(np.count_nonzero(~hatch)),
+            'contour_segments': int(segments[~hatch].sum()),
+        }
 
     def show_preview(self):
         ''' display the generated SVG in the browser'''
-        disvg(self._paths)
+        self._paths.show()
 
-    def save_output(self, filename):
-        wsvg(self._paths, filename=filename, mindim=1024)
+    @instrumented('save_output')
+    def save_output(self, filename, **plotter_settings):
+        '''write the paths as SVG, or as G-code / HPGL for .gcode, .nc, .ngc, .hpgl and .plt files
+        (see hatchybatch.export for the plotter settings)'''
+        if writer_for(filename) is None:
+            self._paths.write_svg(filename, mindim=1024)
+        else:
+            export(self._paths, filename, self.imageshape, **plotter_settings)
 
 
 class Pentip():
     '''pentip used to follow the vector field'''
 
     def __init__(self, x, y):
-        self.pos = np.array([x, y], dtype=np.float32)
+        self.pos = np.array([x, y], dtype=np.float64)
         self.ppos = self.pos.copy()
-        self.dir = np.array([0, 0], dtype=np.float32)
+        self.dir = np.array([0, 0], dtype=np.float64)
         self.pdir = self.dir.copy()
 
     def distance(self, other):
         return np.sqrt(np.sum((self.pos - other.pos) ** 2))
 
 
+class OccupancyGrid():
+    '''spatial hash of stroke points with cells of the separating distance'''
+
+    def __init__(self, shape, cell_size):
+        self.cell_size = max(float(cell_size), 1.0)
+        self.cells = {}
+
+    def add(self, points):
+        for point in points:
+            cell = (int(point[0] // self.cell_size), int(point[1] // self.cell_size))
+            self.cells.setdefault(cell, []).append(point)
+
+    def is_free(self, point, distance):
+        '''True if no stored point is closer than distance'''
+        reach = int(ceil(distance / self.cell_size))
+        cell_x = int(point[0] // self.cell_size)
+        cell_y = int(point[1] // self.cell_size)
+        for x in range(cell_x - reach, cell_x + reach + 1):
+            for y in range(cell_y - reach, cell_y + reach + 1):
+                for other in self.cells.get((x, y), ()):
+                    if hypot(other[0] - point[0], other[1] - point[1]) < distance:
+                        return False
+        return True
+
+
 class ConfigData():
+    '''reads and writes the parameter configuration, keys are the Controller variable names'''
+    DEFAULTS = {
+        'xdog_sigma_high': 1.8,
+        'xdog_sigma_low': 1.0,
+        'xdog_sharp_p': 20,
+        'xdog_phi': 0.1,
+        'xdog_epsilon': 20,
+
+        'edgemap_sigma': 2.0,
+        'edgemap_thresh_low': 0.1,
+        'edgemap_thresh_high': 0.2,
+
+        'flowfield_sigma': 1.5,
+        'flowfield_rho': 5.5,
+        'flowfield_hatch_sigma': 1.0,
+
+        'thresh_low_min': 0.1,
+        'thresh_low_max': 0.2,
+        'thresh_midlow_min': 0.2,
+        'thresh_midlow_max': 0.4,
+        'thresh_midhigh_min': 0.4,
+        'thresh_midhigh_max': 0.6,
+        'thresh_high_min': 0.6,
+        'thresh_high_max': 0.9,
+
+        'edge_probability': 0.5,
+        'edge_length': 5,
+        'low_length': 20,
+        'midlow_length': 20,
+        'midhigh_length': 20,
+        'high_length': 20,
+
+        'low_distance': 4,
+        'midlow_distance': 7,
+        'midhigh_distance': 10,
+        'high_distance': 20,
+
+        'low_crosshatch': False,
+        'midlow_crosshatch': False,
+        'midhigh_crosshatch': False,
+        'high_crosshatch': False,
+
+        'xdog_output': True,
+        'edges_output': True,
+        'hatch_output': True,
+        'vectorized_tracing': True,
+        'tracing_workers': 1,
+        'seed': 0,
+        'progressive_preview': False,
+        'even_spacing': False,
+        'simplify_tolerance': 0.25,
+        'optimize_travel': True,
+        'profile_memory': False,
+        'float32_pipeline': False,
+        'blur_backend': 'skimage',
+
+        'plot_width': 200.0,
+        'plot_feed_rate': 3000.0,
+        'plot_pen_up': 'G0 Z5',
+        'plot_pen_down': 'G0 Z0',
+    }
+    BANDS = ('low', 'midlow', 'midhigh', 'high')
+    # settings of the image stages (see iter_stages), the rest only affects the tracing
+    STAGE_KEYS = ('float32_pipeline', 'blur_backend', 'flowfield_sigma', 'flowfield_rho', 'flowfield_hatch_sigma',
+                  'edgemap_sigma', 'edgemap_thresh_low', 'edgemap_thresh_high',
+                  'xdog_sigma_high', 'xdog_sigma_low', 'xdog_sharp_p', 'xdog_phi', 'xdog_epsilon',
+                  'thresh_low_min', 'thresh_low_max', 'thresh_midlow_min', 'thresh_midlow_max',
+                  'thresh_midhigh_min', 'thresh_midhigh_max', 'thresh_high_min', 'thresh_high_max')
+    # settings measured in pixels, they have to follow the image scale
+    PIXEL_KEYS = ('xdog_sigma_high', 'xdog_sigma_low', 'edgemap_sigma', 'flowfield_sigma',
+                  'flowfield_rho', 'flowfield_hatch_sigma', 'edge_length',
+                  'low_length', 'midlow_length', 'midhigh_length', 'high_length',
+                  'low_distance', 'midlow_distance', 'midhigh_distance', 'high_distance',
+                  'simplify_tolerance')
+
+    @classmethod
+    def with_defaults(cls, config):
+        '''complete a (possibly partial) config with the default values'''
+        return {**cls.DEFAULTS, **config}
+
+    @classmethod
+    def scaled(cls, config, factor):
+        '''config for an image scaled by factor, integer settings stay integers of at least 1'''
+        scaled = dict(config)
+        for key in cls.PIXEL_KEYS:
+            if isinstance(config[key], int):
+                scaled[key] = max(1, int(round(config[key] * factor)))
+            else:
+                scaled[key] = config[key] * factor
+        return scaled
+
+    @classmethod
+    def band_values(cls, config, pattern):
+        '''per band values of a setting, e.g. band_values(config, '{}_length') -> [low_length, ...]'''
+        return [config[pattern.format(band)] for band in cls.BANDS]
+
+    @classmethod
+    def dtype(cls, config):
+        '''floating point type of the ImageData stages'''
+        return np.float32 if config['float32_pipeline'] else np.float64
+
+    @classmethod
+    def plotter_settings(cls, config):
+        '''keyword arguments of Tracer.save_output for the plotter formats'''
+        return {'width': config['plot_width'],
+                'feed_rate': config['plot_feed_rate'],
+                'pen_up': config['plot_pen_up'],
+                'pen_down': config['plot_pen_down']}
+
     def save_config(self, filename, config):
         with open(filename, 'w') as f:
             json.dump(config, f)
@@ -207,3 +833,73 @@ class ConfigData():
     def load_config(self, filename):
         with open(filename, 'r') as f:
             return json.load(f)
+
+
+def iter_stages(model, config):
+    '''run the image data stages needed for tracing with the given config, yields the name of every finished stage'''
+    model.generate_XDoG(
+        config['xdog_sigma_high'],
+        config['xdog_sigma_low'],
+        config['xdog_sharp_p'],
+        config['xdog_phi'],
+        config['xdog_epsilon'])
+    yield 'xdog'
+    model.generate_thresholds(
+        ConfigData.band_values(config, 'thresh_{}_min'),
+        ConfigData.band_values(config, 'thresh_{}_max'))
+    yield 'thresholds'
+    model.generate_edge_map(
+        config['edgemap_sigma'],
+        config['edgemap_thresh_low'],
+        config['edgemap_thresh_high'])
+    yield 'edgemap'
+    model.generate_flow_field(
+        config['flowfield_sigma'],
+        config['flowfield_rho'],
+        config['flowfield_hatch_sigma'])
+    yield 'flowfield'
+
+
+def calculate_stages(model, config):
+    '''run the image data stages needed for tracing with the given config'''
+    for _ in iter_stages(model, config):
+        pass
+
+
+def trace(model, config):
+    '''trace the paths of a calculated image data model with the given config'''
+    tracer = Tracer(
+        model.source.shape,
+        model.edgemap,
+        model.xdog_thresholds if config['xdog_output'] else model.thresholds,
+        model.flowfield_u,
+        model.flowfield_v,
+        model.flowfield_hatch_u,
+        model.flowfield_hatch_v,
+        config['seed'])
+    tracer.recorder = getattr(model, 'recorder', None)
+    engine = 'vectorized' if config['vectorized_tracing'] else 'loop'
+    tracing = tracer
+    if config['tracing_workers'] > 1:
+        from hatchybatch.parallel import ParallelTracing
+        tracing = ParallelTracing(tracer, config['tracing_workers'])
+    if config['edges_output']:
+        tracing.generate_contours(
+            config['edge_length'], config['edge_probability'], engine=engine)
+    if config['hatch_output'] and config['even_spacing']:
+        tracing.generate_even_hatchpaths(
+            ConfigData.band_values(config, '{}_length'),
+            ConfigData.band_values(config, '{}_distance'),
+            ConfigData.band_values(config, '{}_crosshatch'))
+    elif config['hatch_output']:
+        tracing.generate_hatchpaths(
+            ConfigData.band_values(config, '{}_length'),
+            ConfigData.band_values(config, '{}_distance'),
+            ConfigData.band_values(config, '{}_crosshatch'),
+            engine=engine)
+    if tracing is not tracer:
+        tracing.run()
+    tracer.vertex_counts = (tracer._paths.vertex_count,) * 2
+    if config['simplify_tolerance'] > 0:
+        tracer.vertex_counts = tracer.simplify(config['simplify_tolerance'])
+    return tracer
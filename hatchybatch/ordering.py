@@ -0,0 +1,124 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def distances(a, b):
+    '''row wise euclidean distances of two (n, 2) point arrays'''
+    return np.hypot(a[:, 0] - b[:, 0], a[:, 1] - b[:, 1])
+
+
+def endpoints(store):
+    '''first and last point of every path'''
+    offsets = store.offsets
+    coords = store.coords
+    return (coords[offsets[:-1]].astype(np.float64),
+            coords[offsets[1:] - 1].astype(np.float64))
+
+
+def oriented(first, last, order, reverse):
+    '''start and end points of the paths in drawing order and direction'''
+    flip = reverse[:, None]
+    return (np.where(flip, last[order], first[order]),
+            np.where(flip, first[order], last[order]))
+
+
+def travel_distance(store, order=None, reverse=None, origin=(0.0, 0.0)):
+    '''total pen-up distance: from origin to the first path and between consecutive paths'''
+    if len(store) == 0:
+        return 0.0
+    order = np.arange(len(store)) if order is None else order
+    reverse = np.zeros(len(order), dtype=bool) if reverse is None else reverse
+    starts, ends = oriented(*endpoints(store), order, reverse)
+    return float(distances(np.concatenate(([origin], ends[:-1])), starts).sum())
+
+
+def greedy_order(store, origin=(0.0, 0.0), neighbours=16):
+    '''nearest neighbour tour over the path end points, a path may be drawn in either direction
+
+    returns the path order and a reverse flag per position. The nearest end points of all end
+    points are looked up in one KD-tree query, only when all of them are drawn already the
+    tree of the remaining paths is searched (it is rebuilt once half of its paths are drawn)'''
+    count = len(store)
+    if count == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    starts, ends = endpoints(store)
+    points = np.concatenate((starts, ends))
+    tree = cKDTree(points)
+    near = tree.query(points, k=min(neighbours, len(points)))[1].reshape(len(points), -1).tolist()
+    drawn = np.zeros(count, dtype=bool).tolist()
+    remaining = np.arange(count)
+    order = []
+    exit_point = None
+    for step in range(count):
+        # end point ids: path i starts at i and ends at count + i
+        hit = None
+        if exit_point is not None:
+            for candidate in near[exit_point]:
+                if not drawn[candidate % count]:
+                    hit = candidate
+                    break
+        if hit is None:
+            if len(remaining) > 64 and 2 * (count - step) < len(remaining):
+                remaining = np.flatnonzero(~np.array(drawn))
+                tree = cKDTree(np.concatenate((starts[remaining], ends[remaining])))
+            size = len(remaining)
+            position = origin if exit_point is None else points[exit_point]
+            k = min(neighbours, tree.n)
+            while hit is None:
+                for candidate in np.atleast_1d(tree.query(position, k=k)[1]).tolist():
+                    path = int(remaining[candidate % size])
+                    if not drawn[path]:
+                        hit = path + count * (candidate >= size)
+                        break
+                k = min(4 * k, tree.n)
+        path = hit % count
+        order.append(hit)
+        drawn[path] = True
+        exit_point = path if hit >= count else path + count
+    order = np.array(order, dtype=np.int64)
+    return order % count, order >= count
+
+
+def two_opt(store, order, reverse, origin=(0.0, 0.0), window=32, passes=4):
+    '''bounded 2-opt: reverse runs of up to window consecutive paths (flipping each path)
+    while that shortens the travel
+
+    a reversal of the positions i..j only changes the moves into i and out of j, so the gains of
+    all runs of one length are computed at once and the non-overlapping improvements applied'''
+    order = order.copy()
+    reverse = reverse.copy()
+    count = len(order)
+    origin = np.asarray(origin, dtype=np.float64)
+    starts, ends = oriented(*endpoints(store), order, reverse)
+    for _ in range(passes):
+        improved = False
+        for width in range(min(window, count)):
+            last = count - width
+            before = np.concatenate(([origin], ends[:last - 1]))
+            first, final = starts[:last], ends[width:]
+            after = starts[width + 1:]
+            gain = distances(before, first) - distances(before, final)
+            gain[:-1] += distances(final[:-1], after) - distances(first[:-1], after)
+            end = -1
+            for i in np.flatnonzero(gain > 1e-6).tolist():
+                if i <= end:
+                    continue
+                end = i + width + 1
+                order[i:end] = order[i:end][::-1]
+                reverse[i:end] = ~reverse[i:end][::-1]
+                starts[i:end], ends[i:end] = ends[i:end][::-1].copy(), starts[i:end][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return order, reverse
+
+
+def optimize_order(store, origin=(0.0, 0.0), window=32, passes=4):
+    '''reordered store with less pen-up travel, returns the store and the travel before and after'''
+    before = travel_distance(store, origin=origin)
+    order, reverse = greedy_order(store, origin)
+    order, reverse = two_opt(store, order, reverse, origin, window, passes)
+    after = travel_distance(store, order, reverse, origin)
+    if after >= before:
+        return store, (before, before)
+    return store.reordered(order, reverse), (before, after)
@@ -0,0 +1,198 @@
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from multiprocessing import shared_memory
+import numpy as np
+from hatchybatch.instrument import instrumented
+from hatchybatch.models import Tracer
+
+# strips per worker and band, more strips balance the load better (the hatching is
+# denser in some parts of the image), every strip returns its strokes separately
+STRIPS_PER_WORKER = 4
+# seed points (or edge pixels) below which a strip is not worth a task
+MIN_STRIP = 256
+
+# fields of the tracer in the worker processes, set by init_worker
+_fields = {}
+
+
+def file_region(array):
+    '''(filename, offset) of a C contiguous array inside a file memory map, None for all
+    other arrays. Views of a memmap keep the offset of the whole map, so the offset is
+    taken relative to the outermost memmap'''
+    if not isinstance(array, np.memmap) or not array.flags.c_contiguous:
+        return None
+    root = array
+    while isinstance(root.base, np.memmap):
+        root = root.base
+    if root.filename is None:
+        return None
+    return root.filename, root.offset + array.ctypes.data - root.ctypes.data
+
+
+class SharedArrays():
+    '''arrays (or lists of arrays) shared with other processes through a picklable spec
+    ({name: entry or [entries]}), which attach() turns back into read only arrays
+
+    arrays that are memory-mapped from a file (the fields of TiledImageData and the sweep's
+    StageArrays) are opened again from that file, everything else is copied once to a
+    multiprocessing.shared_memory block. The blocks are removed by close()'''
+
+    def __init__(self, arrays):
+        self.blocks = []
+        self.spec = {}
+        for name, value in arrays.items():
+            if isinstance(value, (list, tuple)):
+                self.spec[name] = [self.share(array) for array in value]
+            else:
+                self.spec[name] = self.share(value)
+
+    def share(self, array):
+        region = file_region(array)
+        if region is not None:
+            return ('file',) + region + (array.shape, array.dtype.str)
+        array = np.asarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        self.blocks.append(block)
+        return ('shm', block.name, array.shape, array.dtype.str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    @staticmethod
+    def attach(spec):
+        '''read only arrays of a spec and the opened blocks, which have to stay referenced
+        as long as the arrays are used'''
+        blocks = []
+
+        def open_entry(entry):
+            if entry[0] == 'file':
+                _, filename, offset, shape, dtype = entry
+                return np.memmap(filename, dtype, 'r', offset, shape)
+            _, block_name, shape, dtype = entry
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            array = np.ndarray(shape, dtype, buffer=block.buf)
+            array.flags.writeable = False
+            return array
+
+        arrays = {name: [open_entry(e) for e in entry] if isinstance(entry, list) else open_entry(entry)
+                  for name, entry in spec.items()}
+        return arrays, blocks
+
+
+def init_worker(spec, imageshape, seed):
+    arrays, blocks = SharedArrays.attach(spec)
+    _fields.update(arrays, blocks=blocks, imageshape=imageshape, seed=seed)
+
+
+def run_task(task):
+    '''trace one task on the shared fields, returns the strokes as (coords, lengths, bands,
+    kinds) and the seed counts per band'''
+    kind, band, args = task
+    hatchmaps = _fields['hatchmaps']
+    tracer = Tracer.from_fields(_fields['imageshape'], _fields['pixels'], _fields['degrees'],
+                                hatchmaps, _fields['hatch_u'], _fields['hatch_v'], _fields['seed'])
+    if kind == 'contours':
+        start, stop, draws, engine = args
+        tracer.edgemap = tracer.edgemap[start:stop]
+        tracer.degrees = tracer.degrees[start:stop]
+        if engine == 'loop':
+            tracer.trace_contours_loop(draws)
+        else:
+            tracer.trace_contours_vectorized(draws)
+    elif kind == 'hatch':
+        seed_points, draws, crosshatch, engine = args
+        tracer.seed_counts[band] += len(seed_points)
+        trace_band = tracer.trace_band_loop if engine == 'loop' else tracer.trace_band_vectorized
+        trace_band(band, hatchmaps[band], seed_points, draws, crosshatch)
+    else:
+        path_length, separation, crosshatch, test_ratio = args
+        tracer.trace_band_even(band, hatchmaps[band], path_length, separation, crosshatch, test_ratio)
+    paths = tracer._paths
+    return (paths.coords.copy(), np.diff(paths.offsets), paths.bands.copy(), paths.kinds.copy(),
+            tracer.seed_counts)
+
+
+class ParallelTracing():
+    '''traces the contours and hatching of a Tracer in worker processes
+
+    the generate_* methods mirror Tracer's and queue tasks, run() executes them: the edge
+    pixels, their orientation, the hatchmaps and the hatch field are shared with the workers
+    (see SharedArrays), the edge pixels and the seed points of every band are split into
+    horizontal strips (ranges of the row major seed points) and the strokes returned by the
+    tasks are appended to the tracer in task order. Even spacing is split per band only, the
+    strokes of a band depend on each other.
+
+    The random values of the seed points and edge pixels are drawn here from the tracer's
+    streams and handed to the tasks with their strips, so the paths are identical to the
+    serial tracing with the same seed, for any number of workers.
+
+    Peak memory: the fields of an in-memory model (ImageData) are copied once to shared
+    memory, 4 bytes per pixel for the hatchmaps plus two field values (8 or 16 bytes) per
+    pixel for the hatch field, on top of the model. Memory-mapped fields (TiledImageData)
+    are not copied, the workers map the same files and share their pages. The edge pixels
+    and their orientation (24 bytes per edge pixel) are always copied, every worker holds
+    the strokes of one strip and the merged strokes end up in the tracer'''
+
+    def __init__(self, tracer, workers):
+        self.tracer = tracer
+        self.workers = workers
+        self.recorder = tracer.recorder
+        self.tasks = []
+
+    def strips(self, count):
+        '''(start, stop) ranges splitting count row major points into strips'''
+        size = max(MIN_STRIP, ceil(count / (self.workers * STRIPS_PER_WORKER)))
+        return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+    def generate_contours(self, path_length, probability, engine='vectorized'):
+        if engine not in Tracer.ENGINES:
+            raise ValueError(f'unknown tracing engine "{engine}"')
+        draws = self.tracer.contour_draws(path_length, probability)
+        for start, stop in self.strips(len(self.tracer.edgemap)):
+            self.tasks.append(('contours', -1, (
+                start, stop, [draw[start:stop] for draw in draws], engine)))
+
+    def generate_hatchpaths(self, path_lengths, distances, crosshatch, engine='vectorized'):
+        if engine not in Tracer.ENGINES:
+            raise ValueError(f'unknown tracing engine "{engine}"')
+        for idx, hatchmap in enumerate(self.tracer.hatchmaps):
+            seed_points = self.tracer.generate_seed_points(hatchmap, distances[idx])
+            draws = self.tracer.stroke_draws(self.tracer.stream(idx), len(seed_points), path_lengths[idx])
+            for start, stop in self.strips(len(seed_points)):
+                self.tasks.append(('hatch', idx, (
+                    seed_points[start:stop], [draw[start:stop] for draw in draws], crosshatch[idx], engine)))
+
+    def generate_even_hatchpaths(self, path_lengths, distances, crosshatch, test_ratio=0.5):
+        for idx in range(len(self.tracer.hatchmaps)):
+            self.tasks.append(('even', idx, (path_lengths[idx], distances[idx], crosshatch[idx], test_ratio)))
+
+    @instrumented('parallel_tracing', stats='stats')
+    def run(self):
+        '''run the queued tasks on up to workers processes'''
+        if not self.tasks:
+            return
+        tracer = self.tracer
+        fields = {'pixels': tracer.edgemap, 'degrees': tracer.degrees,
+                  'hatchmaps': list(tracer.hatchmaps),
+                  'hatch_u': tracer.hatch_u, 'hatch_v': tracer.hatch_v}
+        imageshape = tuple(int(n) for n in tracer.imageshape)
+        with SharedArrays(fields) as shared, ProcessPoolExecutor(
+                max_workers=min(self.workers, len(self.tasks)), initializer=init_worker,
+                initargs=(shared.spec, imageshape, tracer.seed)) as pool:
+            for coords, lengths, bands, kinds, seed_counts in pool.map(run_task, self.tasks):
+                tracer._paths.extend(coords, lengths, bands, kinds)
+                tracer.seed_counts = [a + b for a, b in zip(tracer.seed_counts, seed_counts)]
+
+    def stats(self):
+        return {**self.tracer.band_stats(), 'workers': self.workers, 'tasks': len(self.tasks)}
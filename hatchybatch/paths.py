@@ -0,0 +1,243 @@
+import os
+import webbrowser
+from math import ceil
+from tempfile import gettempdir
+from time import time
+import numpy as np
+
+HATCH = 0
+CROSSHATCH = 1
+CONTOUR = 2
+
+
+class PathStore():
+    '''compact polyline container: one flat float32 (x, y) buffer, an offsets array and per path metadata
+
+    path i owns the points coords[offsets[i]:offsets[i + 1]], its band index is bands[i]
+    (-1 for contours) and its kind is one of HATCH, CROSSHATCH or CONTOUR'''
+    KINDS = ('hatch', 'crosshatch', 'contour')
+
+    def __init__(self, capacity=4096):
+        self._coords = np.empty((capacity, 2), dtype=np.float32)
+        self._offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self._bands = np.empty(capacity, dtype=np.int8)
+        self._kinds = np.empty(capacity, dtype=np.uint8)
+        self._count = 0
+
+    @classmethod
+    def from_arrays(cls, coords, offsets, bands, kinds):
+        '''build a store from already flattened buffers'''
+        store = cls(capacity=0)
+        store._coords = np.ascontiguousarray(coords, dtype=np.float32).reshape(-1, 2)
+        store._offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        store._bands = np.ascontiguousarray(bands, dtype=np.int8)
+        store._kinds = np.ascontiguousarray(kinds, dtype=np.uint8)
+        store._count = len(store._offsets) - 1
+        return store
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._count
+        if not 0 <= idx < self._count:
+            raise IndexError('path index out of range')
+        return self._coords[self._offsets[idx]:self._offsets[idx + 1]]
+
+    def __iter__(self):
+        coords = self.coords
+        offsets = self.offsets
+        for idx in range(self._count):
+            yield coords[offsets[idx]:offsets[idx + 1]]
+
+    @property
+    def coords(self):
+        return self._coords[:self._offsets[self._count]]
+
+    @property
+    def offsets(self):
+        return self._offsets[:self._count + 1]
+
+    @property
+    def bands(self):
+        return self._bands[:self._count]
+
+    @property
+    def kinds(self):
+        return self._kinds[:self._count]
+
+    @property
+    def vertex_count(self):
+        return int(self._offsets[self._count])
+
+    @property
+    def segment_count(self):
+        return self.vertex_count - self._count
+
+    def _reserve(self, paths, points):
+        '''grow the buffers (amortized doubling) to hold additional paths and points'''
+        needed = self._count + paths
+        if needed > len(self._bands):
+            capacity = max(needed, 2 * len(self._bands))
+            self._offsets = np.resize(self._offsets, capacity + 1)
+            self._bands = np.resize(self._bands, capacity)
+            self._kinds = np.resize(self._kinds, capacity)
+        needed = self._offsets[self._count] + points
+        if needed > len(self._coords):
+            capacity = max(needed, 2 * len(self._coords))
+            coords = np.empty((capacity, 2), dtype=np.float32)
+            coords[:len(self._coords)] = self._coords
+            self._coords = coords
+
+    def append(self, points, band=-1, kind=HATCH):
+        '''add a single polyline given as (n, 2) array of x, y points'''
+        points = np.asarray(points)
+        self._reserve(1, len(points))
+        start = self._offsets[self._count]
+        self._coords[start:start + len(points)] = points
+        self._offsets[self._count + 1] = start + len(points)
+        self._bands[self._count] = band
+        self._kinds[self._count] = kind
+        self._count += 1
+
+    def extend(self, points, lengths, bands=-1, kinds=HATCH):
+        '''add many polylines at once, points are concatenated and split by lengths'''
+        points = np.asarray(points)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        self._reserve(len(lengths), len(points))
+        start = self._offsets[self._count]
+        self._coords[start:start + len(points)] = points
+        self._offsets[self._count + 1:self._count + 1 + len(lengths)] = start + np.cumsum(lengths)
+        self._bands[self._count:self._count + len(lengths)] = bands
+        self._kinds[self._count:self._count + len(lengths)] = kinds
+        self._count += len(lengths)
+
+    def scale(self, factor):
+        '''scale all points in place, e.g. to map a preview to full resolution coordinates'''
+        self.coords[:] *= factor
+
+    def bounding_box(self):
+        '''xmin, xmax, ymin, ymax of all points'''
+        coords = self.coords
+        if len(coords) == 0:
+            return 0.0, 1.0, 0.0, 1.0
+        xmin, ymin = coords.min(axis=0)
+        xmax, ymax = coords.max(axis=0)
+        return float(xmin), float(xmax), float(ymin), float(ymax)
+
+    def simplify(self, tolerance):
+        '''new store with every path simplified by Ramer-Douglas-Peucker to the tolerance (in pixels)
+
+        all paths are simplified together: each round splits every open span at its vertex
+        farthest from the chord between the span's kept end points, until no vertex is farther
+        than the tolerance. The first and last point of each path are always kept'''
+        coords = self.coords.astype(np.float64)
+        offsets = self.offsets
+        keep = np.zeros(len(coords), dtype=bool)
+        keep[offsets[:-1]] = True
+        keep[offsets[1:] - 1] = True
+        index = np.arange(len(coords))
+        while len(coords):
+            # kept vertices before and after every vertex span the chord it is measured against
+            start = np.maximum.accumulate(np.where(keep, index, 0))
+            end = np.minimum.accumulate(np.where(keep, index, len(coords))[::-1])[::-1]
+            chord = coords[end] - coords[start]
+            rel = coords - coords[start]
+            length = np.hypot(chord[:, 0], chord[:, 1])
+            distance = np.where(
+                length > 0,
+                np.abs(chord[:, 0] * rel[:, 1] - chord[:, 1] * rel[:, 0]) / np.maximum(length, 1e-12),
+                np.hypot(rel[:, 0], rel[:, 1]))
+            distance[keep] = -1
+            starts = np.flatnonzero(keep)
+            farthest = np.maximum.reduceat(distance, starts)
+            group = np.cumsum(keep) - 1
+            candidates = np.flatnonzero(
+                (distance > tolerance) & (distance == farthest[group]))
+            if len(candidates) == 0:
+                break
+            # ties keep only the first vertex of a span, like the recursive algorithm
+            _, first = np.unique(group[candidates], return_index=True)
+            keep[candidates[first]] = True
+        lengths = np.add.reduceat(keep.astype(np.int64), offsets[:-1]) if self._count else np.zeros(0, np.int64)
+        return PathStore.from_arrays(
+            self.coords[keep], np.concatenate(([0], np.cumsum(lengths))), self.bands, self.kinds)
+
+    def reordered(self, order, reverse=None):
+        '''new store with the paths in the given order, paths flagged in reverse run backwards'''
+        order = np.asarray(order, dtype=np.int64)
+        lengths = np.diff(self.offsets)[order]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        local = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+        if reverse is not None:
+            local = np.where(np.repeat(reverse, lengths), np.repeat(lengths - 1, lengths) - local, local)
+        index = np.repeat(self.offsets[:-1][order], lengths) + local
+        return PathStore.from_arrays(self.coords[index], offsets, self.bands[order], self.kinds[order])
+
+    def to_svgpathtools(self):
+        '''convert to a list of svgpathtools Paths made from Lines'''
+        from svgpathtools import Path, Line
+        paths = []
+        for points in self:
+            z = points[:, 0].astype(float) + 1j * points[:, 1].astype(float)
+            paths.append(Path(*[Line(a, b) for a, b in zip(z[:-1], z[1:])]))
+        return paths
+
+    def write_svg(self, filename, mindim=1024, margin_size=0.1):
+        '''write the paths as SVG, with the same framing as svgpathtools.wsvg, one path element at a time'''
+        xmin, xmax, ymin, ymax = self.bounding_box()
+        dx = (xmax - xmin) or 1
+        dy = (ymax - ymin) or 1
+        stroke_width = max(dx, dy) * 1e-3
+        xmin -= margin_size * dx + stroke_width / 2
+        ymin -= margin_size * dy + stroke_width / 2
+        dx += 2 * margin_size * dx + stroke_width
+        dy += 2 * margin_size * dy + stroke_width
+        if dx > dy:
+            width, height = mindim, int(ceil(mindim * dy / dx))
+        else:
+            width, height = int(ceil(mindim * dx / dy)), mindim
+        with open(filename, 'w') as f:
+            f.write('<?xml version="1.0" encoding="utf-8" ?>\n')
+            f.write(f'<svg baseProfile="full" height="{height}px" version="1.1" '
+                    f'viewBox="{xmin} {ymin} {dx} {dy}" width="{width}px" '
+                    'xmlns="http://www.w3.org/2000/svg" xmlns:ev="http://www.w3.org/2001/xml-events" '
+                    'xmlns:xlink="http://www.w3.org/1999/xlink">\n')
+            f.write(f'<g fill="none" stroke="#000000" stroke-width="{stroke_width}">\n')
+            for points in self:
+                f.write(f'<path d="{path_data(points)}"/>\n')
+            f.write('</g>\n</svg>\n')
+
+    def show(self):
+        '''write the paths to a temporary SVG and open it in the browser'''
+        filename = os.path.join(
+            gettempdir(), f'hatchybatch_preview_{str(time()).replace(".", "")}.svg')
+        self.write_svg(filename)
+        webbrowser.open('file://' + os.path.abspath(filename))
+
+
+def path_data(points):
+    '''SVG path "d" attribute for a polyline'''
+    coords = [f'{x:.2f},{y:.2f}' for x, y in points.tolist()]
+    return 'M ' + ' L '.join(coords)
+
+
+def point_along(points, fraction):
+    '''point at a fraction of the arc length of a polyline (like svgpathtools Path.point)'''
+    lengths = np.hypot(*np.diff(points, axis=0).T)
+    cumulative = np.cumsum(lengths)
+    target = fraction * cumulative[-1]
+    idx = min(int(np.searchsorted(cumulative, target)), len(lengths) - 1)
+    start = cumulative[idx] - lengths[idx]
+    t = (target - start) / lengths[idx] if lengths[idx] else 0.0
+    return points[idx] + t * (points[idx + 1] - points[idx])
+
+
+def rotate(points, degrees, origin):
+    '''rotate (n, 2) x, y points counterclockwise (in SVG coordinates) by degrees around origin'''
+    rads = np.radians(degrees)
+    cos, sin = np.cos(rads), np.sin(rads)
+    rel = np.subtract(points, origin)
+    return np.stack((origin[0] + cos * rel[:, 0] - sin * rel[:, 1],
+                     origin[1] + sin * rel[:, 0] + cos * rel[:, 1]), axis=1)
@@ -0,0 +1,97 @@
+from threading import RLock
+
+
+class Stage():
+    '''a node of the stage graph, memoized on its parameters and the keys of its dependencies'''
+
+    def __init__(self, name, compute, params=(), deps=(), persistent=False):
+        self.name = name
+        self.persistent = persistent
+        self.compute = compute
+        self.params = tuple(params)
+        self.deps = tuple(deps)
+        self.key = None
+        self.value = None
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.key = None
+        self.value = None
+
+
+class StageGraph():
+    '''directed acyclic graph of memoized stages
+
+    a stage is computed as compute(*dependency values, *parameter values), it is only
+    recomputed when one of its parameters or a parameter of an upstream stage changed.
+    Values of persistent stages are also looked up in the store (e.g. a DiskCache) by
+    (name, key) before anything upstream is computed'''
+
+    def __init__(self, store=None):
+        self.stages = {}
+        self.store = store
+        self._lock = RLock()
+
+    def add(self, name, compute, params=(), deps=(), persistent=False):
+        for dep in deps:
+            if dep not in self.stages:
+                raise KeyError(f'unknown dependency "{dep}" of stage "{name}"')
+        self.stages[name] = Stage(name, compute, params, deps, persistent)
+
+    def key(self, name, params):
+        '''memo key of a stage: its own parameter values and the keys of its dependencies'''
+        stage = self.stages[name]
+        return (tuple(params[p] for p in stage.params),
+                tuple(self.key(dep, params) for dep in stage.deps))
+
+    def is_stale(self, name, params):
+        return self.stages[name].key != self.key(name, params)
+
+    def get(self, name, params):
+        '''value of a stage for the given parameters, recomputing only stale stages'''
+        with self._lock:
+            return self._get(name, params)
+
+    def _get(self, name, params):
+        stage = self.stages[name]
+        key = self.key(name, params)
+        if stage.key == key:
+            stage.hits += 1
+            return stage.value
+        stage.misses += 1
+
+        def compute():
+            inputs = [self._get(dep, params) for dep in stage.deps]
+            return stage.compute(*inputs, *[params[p] for p in stage.params])
+        if stage.persistent and self.store is not None:
+            value = self.store.get((name, key), compute)
+        else:
+            value = compute()
+        stage.key, stage.value = key, value
+        return value
+
+    def invalidate(self, name=None):
+        '''forget the memoized value of a stage and everything downstream, or of all stages'''
+        with self._lock:
+            for stage in self.stages.values():
+                if name is None or stage.name == name or name in self.upstream(stage.name):
+                    stage.clear()
+
+    def upstream(self, name):
+        '''names of all stages the given stage depends on'''
+        names = set()
+        for dep in self.stages[name].deps:
+            names.add(dep)
+            names |= self.upstream(dep)
+        return names
+
+    def stats(self):
+        '''hit and miss counts per stage'''
+        return {name: {'hits': stage.hits, 'misses': stage.misses}
+                for name, stage in self.stages.items()}
+
+    def reset_stats(self):
+        for stage in self.stages.values():
+            stage.hits = 0
+            stage.misses = 0
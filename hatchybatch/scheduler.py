@@ -0,0 +1,142 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from hatchybatch.instrument import logger
+
+
+class Cancelled(Exception):
+    '''raised by Job.check once the job has been superseded or cancelled'''
+
+
+class Job():
+    '''a unit of background work, work(job) runs on the worker thread and should call
+    job.check() at its stage boundaries. A job submitted with a parent (the job that
+    started it) counts as cancelled once its parent is'''
+
+    def __init__(self, scheduler, key, work, done=None, failed=None, due=0.0, parent=None):
+        self.scheduler = scheduler
+        self.key = key
+        self.work = work
+        self.done = done
+        self.failed = failed
+        self.due = due
+        self.parent = parent
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled(self.key)
+
+    def post(self, callback, *args):
+        '''run callback(*args) on the Tk main loop, dropped if the job is cancelled by then'''
+        self.scheduler.results.put((self, callback, args))
+
+
+class Scheduler():
+    '''one worker thread running queued jobs in order of their due time
+
+    submitting a job replaces the pending job with the same key (debounce: a delay pushes
+    the due time back on every submission) and cancels the running one, which stops at its
+    next check(). done(result) and everything posted by a job are called from the Tk main
+    loop by poll(), which re-arms itself every interval milliseconds; on_poll(job) is called
+    there with the running job (None when idle)'''
+
+    def __init__(self, root, interval=50, on_poll=None):
+        self.root = root
+        self.interval = interval
+        self.on_poll = on_poll
+        self.results = queue.Queue()
+        self.running = None
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._run, name='hatchybatch-scheduler', daemon=True)
+        self._worker.start()
+
+    def start(self):
+        self.root.after(self.interval, self.poll)
+
+    def submit(self, key, work, done=None, failed=None, delay=0, parent=None):
+        '''schedule work(job) to run after delay milliseconds, returns the job'''
+        with self._condition:
+            job = Job(self, key, work, done, failed, time.monotonic() + delay / 1000, parent)
+            self._pending.pop(key, None)
+            self._pending[key] = job
+            if self.running is not None and self.running.key == key:
+                self.running.cancel()
+            self._condition.notify()
+        return job
+
+    def cancel(self, key=None):
+        '''cancel the pending and running jobs with key, or all of them, returns whether
+        there was such a job'''
+        cancelled = False
+        with self._condition:
+            for pending_key in list(self._pending):
+                if key is None or pending_key == key:
+                    self._pending.pop(pending_key).cancel()
+                    cancelled = True
+            if self.running is not None and (key is None or self.running.key == key):
+                self.running.cancel()
+                cancelled = True
+        return cancelled
+
+    def busy(self):
+        with self._condition:
+            return self.running is not None or bool(self._pending)
+
+    def _next(self):
+        '''wait for the next due job and mark it running'''
+        with self._condition:
+            while True:
+                if self._pending:
+                    job = min(self._pending.values(), key=lambda job: job.due)
+                    wait = job.due - time.monotonic()
+                    if wait <= 0:
+                        del self._pending[job.key]
+                        self.running = job
+                        return job
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            job = self._next()
+            try:
+                result = job.work(job)
+                if job.done is not None:
+                    job.post(job.done, result)
+            except Cancelled:
+                logger.debug(f'job {job.key} cancelled')
+            except Exception as e:
+                logger.exception(f'job {job.key} failed')
+                if job.failed is not None:
+                    job.post(job.failed, e)
+            finally:
+                with self._condition:
+                    self.running = None
+
+    def poll(self):
+        '''main loop side: run the callbacks posted by jobs that are still current'''
+        try:
+            while True:
+                job, callback, args = self.results.get_nowait()
+                if job.cancelled:
+                    continue
+                try:
+                    callback(*args)
+                except Exception:
+                    logger.exception(f'callback of job {job.key} failed')
+        except queue.Empty:
+            pass
+        if self.on_poll is not None:
+            self.on_poll(self.running)
+        self.root.after(self.interval, self.poll)
@@ -0,0 +1,191 @@
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from hatchybatch.batch import available_cores
+from hatchybatch.cache import DiskCache
+from hatchybatch.models import ImageData, ConfigData, calculate_stages, trace
+
+
+class StageArrays():
+    '''the stage results a Tracer needs, saved as .npy files and loaded memory-mapped, so
+    every worker process shares one copy through the page cache'''
+    NAMES = ('source', 'edgemap', 'thresholds', 'xdog_thresholds',
+             'flowfield_u', 'flowfield_v', 'flowfield_hatch_u', 'flowfield_hatch_v')
+
+    def __init__(self, directory):
+        for name in self.NAMES:
+            setattr(self, name, np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r'))
+        self.thresholds = list(self.thresholds)
+        self.xdog_thresholds = list(self.xdog_thresholds)
+
+    @classmethod
+    def save(cls, model, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in cls.NAMES:
+            np.save(os.path.join(directory, f'{name}.npy'), np.asarray(getattr(model, name)))
+
+
+def expand(base, grid=None, runs=None):
+    '''override dicts of a sweep: the cartesian product of the grid ({key: [values]}) combined
+    with every entry of runs ([{key: value}]), keys must be config settings'''
+    grid = grid or {}
+    runs = runs or [{}]
+    for key in itertools.chain(grid, *runs):
+        if key not in base:
+            raise KeyError(f'unknown setting "{key}"')
+    product = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    return [{**combination, **run} for combination in product for run in runs]
+
+
+def stage_key(config):
+    '''settings of the image stages, runs with the same key share all stage results'''
+    return tuple(config[key] for key in ConfigData.STAGE_KEYS)
+
+
+def group_runs(base, overrides):
+    '''(stage key, [(run index, config)]) groups, ordered so that consecutive groups share
+    the most expensive stages (flow field first, see ConfigData.STAGE_KEYS)'''
+    groups = {}
+    for idx, override in enumerate(overrides):
+        config = {**base, **override}
+        groups.setdefault(stage_key(config), []).append((idx, config))
+    return sorted(groups.items(), key=lambda item: repr(item[0]))
+
+
+def render_thumbnail(paths, shape, size):
+    '''grayscale raster of the paths, the longest side is size pixels'''
+    height, width = shape
+    scale = size / max(height, width)
+    fig = Figure(figsize=(width * scale / 100, height * scale / 100), dpi=100)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.add_collection(LineCollection(list(paths), linewidths=0.2, colors='k'))
+    ax.set_xlim(0, width)
+    ax.set_ylim(height, 0)
+    ax.axis('off')
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())[..., 0].copy()
+
+
+def trace_run(stage_dir, config, output, thumbnail_size=256):
+    '''trace one run on shared stage results, returns the output name, path count and a thumbnail'''
+    model = StageArrays(stage_dir)
+    tracer = trace(model, config)
+    if config['optimize_travel']:
+        tracer.optimize_travel()
+    tracer.save_output(output, **ConfigData.plotter_settings(config))
+    return output, len(tracer._paths), render_thumbnail(tracer._paths, model.source.shape, thumbnail_size)
+
+
+def write_contact_sheet(filename, thumbnails, labels, columns=4):
+    '''grid of the run thumbnails with their overrides as captions'''
+    rows = max(1, -(-len(thumbnails) // columns))
+    fig = Figure(figsize=(3 * columns, 3.3 * rows), dpi=100)
+    canvas = FigureCanvasAgg(fig)
+    for idx, (thumbnail, label) in enumerate(zip(thumbnails, labels)):
+        ax = fig.add_subplot(rows, columns, idx + 1)
+        ax.imshow(thumbnail, 'gray', vmin=0, vmax=255)
+        ax.set_title(label, fontsize=6)
+        ax.axis('off')
+    fig.tight_layout()
+    canvas.print_png(filename)
+
+
+def sweep(filename, base, overrides, output_dir, workers=1, disk_cache=None):
+    '''render one image under every override of base into output_dir
+
+    the stages of each distinct stage key are computed once in this process (grouped runs
+    reuse the memoized stage graph and blur cache), the tracing of the runs is done by the
+    worker processes. Writes run_###.svg per run, runs.json and contact_sheet.png, returns
+    the list of (output, path count) per run'''
+    os.makedirs(output_dir, exist_ok=True)
+    base = ConfigData.with_defaults(base)
+    model = ImageData(disk_cache)
+    model.load_image(filename)
+    workdir = tempfile.mkdtemp(prefix='hatchybatch_sweep_')
+    jobs = {}
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+            for group, (_, runs) in enumerate(group_runs(base, overrides)):
+                # float64 groups sort first, so switching never rounds their source
+                model.set_dtype(ConfigData.dtype(runs[0][1]))
+                model.set_blur_backend(runs[0][1]['blur_backend'])
+                calculate_stages(model, runs[0][1])
+                stage_dir = os.path.join(workdir, f'group_{group}')
+                StageArrays.save(model, stage_dir)
+                for idx, config in runs:
+                    output = os.path.join(output_dir, f'run_{idx:03d}.svg')
+                    jobs[idx] = pool.submit(trace_run, stage_dir, config, output)
+            results = [jobs[idx].result() for idx in range(len(overrides))]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    labels = [f'{idx:03d} ' + ', '.join(f'{k}={v}' for k, v in override.items())
+              for idx, override in enumerate(overrides)]
+    with open(os.path.join(output_dir, 'runs.json'), 'w') as f:
+        json.dump([{'output': os.path.basename(output), 'paths': count, 'overrides': override}
+                   for (output, count, _), override in zip(results, overrides)], f, indent=1)
+    write_contact_sheet(os.path.join(output_dir, 'contact_sheet.png'),
+                        [thumbnail for _, _, thumbnail in results], labels)
+    return [(output, count) for output, count, _ in results]
+
+
+def parse_value(text):
+    '''JSON value of a command line setting, plain strings for everything else'''
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='hatchybatch.sweep',
+        description='render one image under a grid of settings, sharing the stage results between runs')
+    parser.add_argument('input', help='input image')
+    parser.add_argument('-c', '--config', help='base config JSON as written by "Save config..."')
+    parser.add_argument('-g', '--grid', action='append', default=[], metavar='KEY=V1,V2,...',
+                        help='values of one setting, the runs are all combinations of the grids')
+    parser.add_argument('-r', '--runs', help='JSON list of override dicts, combined with every grid point')
+    parser.add_argument('-o', '--output', default='sweep', help='output directory')
+    parser.add_argument('-j', '--workers', type=int, default=available_cores(),
+                        help='number of tracing processes (default: available cores)')
+    parser.add_argument('--cache-dir', nargs='?', const=DiskCache.DEFAULT_DIRECTORY,
+                        help='reuse stages from an on-disk cache')
+    args = parser.parse_args(argv)
+
+    base = ConfigData.with_defaults(
+        ConfigData().load_config(args.config) if args.config else {})
+    grid = {}
+    for entry in args.grid:
+        key, _, values = entry.partition('=')
+        grid[key] = [parse_value(v) for v in values.split(',')]
+    runs = None
+    if args.runs:
+        with open(args.runs) as f:
+            runs = json.load(f)
+    try:
+        overrides = expand(base, grid, runs)
+    except KeyError as e:
+        parser.error(e.args[0])
+    start = time.perf_counter()
+    results = sweep(args.input, base, overrides, args.output, args.workers,
+                    DiskCache(args.cache_dir) if args.cache_dir else None)
+    for (output, count), override in zip(results, overrides):
+        print(f'{output}  {count:>8} paths  {override}')
+    print(f'{len(results)} runs in {time.perf_counter() - start:.2f}s, '
+          f'contact sheet: {os.path.join(args.output, "contact_sheet.png")}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
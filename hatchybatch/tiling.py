@@ -0,0 +1,176 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import tifffile
+from structure_tensor import eig_special_2d, structure_tensor_2d
+from skimage.color import rgb2gray, rgba2rgb
+from skimage.feature import canny
+from skimage.filters import gaussian
+from skimage.io import imread
+from skimage.util import img_as_float
+from hatchybatch.instrument import instrumented
+from hatchybatch.models import ImageData
+
+
+def gaussian_radius(sigma):
+    '''support of a gaussian kernel truncated at 4 sigma (the scipy/scikit-image default)'''
+    return int(4 * float(sigma) + 0.5)
+
+
+class TiledImageData():
+    ''' image data model for images beyond ImageData.MAX_SIZE
+
+    the image is kept at full resolution, every stage is computed tile by tile on
+    overlapping windows (halo sized from the largest sigma/rho of the stage) and written to
+    memory-mapped arrays in workdir, so peak memory is bounded by the tile size. The
+    attributes and generate_* methods mirror ImageData, so a Tracer can be built from it
+    and will follow the flow field across tile seams.
+
+    differences to ImageData: intermediates are stored as float32, the XDoG is normalized
+    by the maximum over all tiles in a second pass and canny's hysteresis only connects
+    edges within a tile and its halo'''
+    STAGE_ATTRIBUTES = ('xdog', 'thresh_xdog', 'thresholds', 'xdog_thresholds', 'edgemap',
+                        'flowfield_u', 'flowfield_v', 'flowfield_hatch_u', 'flowfield_hatch_v')
+
+    def __init__(self, tile_size=1024, workdir=None, recorder=None):
+        self.tile_size = tile_size
+        self.recorder = recorder
+        self._own_workdir = workdir is None
+        self.workdir = tempfile.mkdtemp(
+            prefix='hatchybatch_') if workdir is None else workdir
+        self.source = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''drop the memory maps and remove the temporary working directory'''
+        for name in self.STAGE_ATTRIBUTES:
+            if hasattr(self, name):
+                delattr(self, name)
+        self.source = None
+        if self._own_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    @property
+    def shape(self):
+        return self.source.shape
+
+    def allocate(self, name, dtype, planes=None):
+        '''memory-mapped output array of the image size (optionally with leading planes)'''
+        shape = self.shape if planes is None else (planes,) + self.shape
+        return np.lib.format.open_memmap(
+            os.path.join(self.workdir, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+
+    def tiles(self, halo):
+        '''yields (tile, window, crop) slices: the tile in image coordinates, the tile plus
+        halo clipped to the image and the position of the tile inside that window'''
+        height, width = self.shape
+        for y in range(0, height, self.tile_size):
+            for x in range(0, width, self.tile_size):
+                y1 = min(y + self.tile_size, height)
+                x1 = min(x + self.tile_size, width)
+                wy, wx = max(y - halo, 0), max(x - halo, 0)
+                wy1, wx1 = min(y1 + halo, height), min(x1 + halo, width)
+                yield (np.s_[y:y1, x:x1],
+                       np.s_[wy:wy1, wx:wx1],
+                       np.s_[y - wy:y1 - wy, x - wx:x1 - wx])
+
+    def window(self, window):
+        return np.asarray(self.source[window], dtype=np.float64)
+
+    @staticmethod
+    def read_image(filename):
+        '''the image as an array, uncompressed TIFFs are memory-mapped and read row block by
+        row block, all other files are decoded as a whole (their 8 or 16 bit samples are the
+        one image sized allocation left)'''
+        if filename.lower().endswith(('.tif', '.tiff')):
+            try:
+                return tifffile.memmap(filename, mode='r')
+            except ValueError:
+                pass
+        return imread(filename)
+
+    @instrumented('load_image', ('source',))
+    def load_image(self, filename):
+        '''loads an image at full resolution and converts it to grayscale row block by row block'''
+        img = self.read_image(filename)
+        if img.ndim > 2 and img.shape[-1] not in (3, 4) and img.shape[0] in (3, 4):
+            img = np.moveaxis(img, 0, -1)
+        self.source = np.lib.format.open_memmap(
+            os.path.join(self.workdir, 'source.npy'), mode='w+', dtype=np.float32, shape=img.shape[:2])
+        for y in range(0, img.shape[0], self.tile_size):
+            block = img[y:y + self.tile_size]
+            if block.ndim > 2:
+                if block.shape[-1] == 4:
+                    block = rgba2rgb(block)
+                block = rgb2gray(block)
+            self.source[y:y + self.tile_size] = img_as_float(block)
+        del img
+
+    @instrumented('xdog', ('xdog',))
+    def generate_XDoG(self, sigma_high, sigma_low, p, phi, epsilon):
+        ''' XDoG per tile, normalized by the global maximum in a second pass'''
+        halo = gaussian_radius(max(sigma_high, sigma_low))
+        ramp = self.allocate('xdog_ramp', np.float32)
+        maximum = -np.inf
+        for tile, window, crop in self.tiles(halo):
+            source = self.window(window)
+            outer = gaussian(source, sigma=sigma_high)
+            inner = gaussian(source, sigma=sigma_low)
+            result = ImageData.xdog_ramp(
+                ImageData.unsharp_mask(outer, inner, p), phi, epsilon)[crop]
+            ramp[tile] = result
+            maximum = max(maximum, float(result.max()))
+        self.xdog = self.allocate('xdog', np.uint8)
+        for tile, window, crop in self.tiles(0):
+            self.xdog[tile] = ImageData.xdog_normalize(ramp[tile], maximum)
+        del ramp
+
+    @instrumented('thresholds', ('thresholds', 'xdog_thresholds'))
+    def generate_thresholds(self, thresh_min_values, thresh_max_values):
+        ''' threshold masks per tile, the halo covers the one pixel dilation'''
+        bands = len(thresh_min_values)
+        self.thresh_xdog = self.allocate('thresh_xdog', bool)
+        thresholds = self.allocate('thresholds', bool, bands)
+        xdog_thresholds = self.allocate('xdog_thresholds', bool, bands)
+        for tile, window, crop in self.tiles(1):
+            thresh_xdog, planes, xdog_planes = ImageData.threshold_masks(
+                self.window(window), np.asarray(self.xdog[window]), thresh_min_values, thresh_max_values)
+            self.thresh_xdog[tile] = thresh_xdog[crop]
+            for band in range(bands):
+                thresholds[band][tile] = planes[band][crop]
+                xdog_thresholds[band][tile] = xdog_planes[band][crop]
+        self.thresholds = list(thresholds)
+        self.xdog_thresholds = list(xdog_thresholds)
+
+    @instrumented('edgemap', ('edgemap',))
+    def generate_edge_map(self, sigma, thresh_high, thresh_low):
+        ''' canny edge detection per tile'''
+        halo = gaussian_radius(sigma) + self.tile_size // 8
+        self.edgemap = self.allocate('edgemap', bool)
+        for tile, window, crop in self.tiles(halo):
+            self.edgemap[tile] = canny(
+                self.window(window), sigma, thresh_high, thresh_low)[crop]
+
+    @instrumented('flowfield', ('flowfield_u', 'flowfield_v', 'flowfield_hatch_u', 'flowfield_hatch_v'))
+    def generate_flow_field(self, sigma, rho, hatchsigma):
+        '''edge tangent flow field per tile, the halo covers the derivative, integration and hatch smoothing kernels'''
+        halo = gaussian_radius(sigma) + gaussian_radius(rho) + \
+            gaussian_radius(hatchsigma) + 1
+        self.flowfield_u = self.allocate('flowfield_u', np.float32)
+        self.flowfield_v = self.allocate('flowfield_v', np.float32)
+        self.flowfield_hatch_u = self.allocate('flowfield_hatch_u', np.float32)
+        self.flowfield_hatch_v = self.allocate('flowfield_hatch_v', np.float32)
+        for tile, window, crop in self.tiles(halo):
+            vec = eig_special_2d(structure_tensor_2d(
+                self.window(window), sigma, rho))[1]
+            hatchfield = gaussian(vec, sigma=hatchsigma)
+            self.flowfield_u[tile] = vec[0][crop]
+            self.flowfield_v[tile] = vec[1][crop]
+            self.flowfield_hatch_u[tile] = hatchfield[0][crop]
+            self.flowfield_hatch_v[tile] = hatchfield[1][crop]
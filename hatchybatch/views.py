@@ -1,12 +1,27 @@
 from matplotlib.backends.backend_tkagg import (
     FigureCanvasTkAgg, NavigationToolbar2Tk)
 from matplotlib.figure import Figure
+import os
 import tkinter as tk
 from tkinter import ttk
+import numpy as np
+from hatchybatch.filters import BACKENDS
 import matplotlib
 matplotlib.use('TkAgg')
 
 
+def downsample(image, size):
+    '''block mean of an image to roughly size (height, width) pixels, so matplotlib only
+    resamples what is shown on screen'''
+    image = np.asarray(image)
+    step = max(1, int(max(image.shape[0] / size[0], image.shape[1] / size[1])))
+    if step == 1:
+        return image
+    height, width = image.shape[0] // step * step, image.shape[1] // step * step
+    return image[:height, :width].reshape(
+        height // step, step, width // step, step).mean(axis=(1, 3), dtype=np.float32)
+
+
 class PathlengthSliders(tk.Frame):
     def __init__(self, parent, controller):
         tk.Frame.__init__(self, parent)
@@ -74,6 +89,17 @@ class PathlengthSliders(tk.Frame):
             orient=tk.HORIZONTAL,
             variable=controller.high_length).pack()
         ttk.Separator(self, orient='horizontal').pack(fill='x')
+        self.simplify_tolerance = tk.Scale(
+            self,
+            from_=0.0,
+            to=2.0,
+            resolution=0.05,
+            length=200,
+            label="simplify tolerance (px)",
+            width=5,
+            orient=tk.HORIZONTAL,
+            variable=controller.simplify_tolerance).pack()
+        ttk.Separator(self, orient='horizontal').pack(fill='x')
         self.output_options = OutputOptions(self, controller).pack(padx=20)
 
 
@@ -137,6 +163,9 @@ class PathdistanceSliders(tk.Frame):
         tk.Checkbutton(
             self, text="crosshatch highlight", variable=controller.high_crosshatch
         ).pack()
+        tk.Checkbutton(
+            self, text="even spacing (distance = stroke separation)", variable=controller.even_spacing
+        ).pack()
         ttk.Separator(self, orient='horizontal').pack(fill='x')
         self.output_options = OutputOptions(self, controller).pack()
 
@@ -288,6 +317,10 @@ class FlowFieldSliders(tk.Frame):
                   text="Recalculate Flowfield",
                   command=controller.show_flowfield,
                   padx=5, pady=5).pack(padx=10, pady=10)
+        tk.Button(self,
+                  text="Full quality LIC",
+                  command=controller.show_full_lic,
+                  padx=5, pady=5).pack(padx=10, pady=(0, 10))
 
 
 class TresholdSliders(tk.Frame):
@@ -392,13 +425,110 @@ class OutputOptions(tk.Frame):
             self, text="output\nedges", variable=controller.edges_output).pack(side=tk.LEFT)
         self.hatch_output = tk.Checkbutton(
             self, text="output\nhatch", variable=controller.hatch_output).pack(side=tk.LEFT)
+        self.vectorized_tracing = tk.Checkbutton(
+            self, text="vectorized\ntracing", variable=controller.vectorized_tracing).pack(side=tk.LEFT)
+        tk.Label(self, text="tracing\nprocesses").pack(side=tk.LEFT)
+        self.tracing_workers = tk.Spinbox(
+            self, from_=1, to=os.cpu_count() or 1, width=3, state='readonly',
+            textvariable=controller.tracing_workers)
+        self.tracing_workers.pack(side=tk.LEFT)
+        tk.Label(self, text="seed").pack(side=tk.LEFT)
+        # only seeds the IntVar can hold, a seed can be typed in to reproduce a run
+        valid_seed = self.register(lambda text: text.isdigit() and int(text) < 2**31)
+        self.seed = tk.Spinbox(
+            self, from_=0, to=2**31 - 1, width=10, textvariable=controller.seed,
+            validate='key', validatecommand=(valid_seed, '%P'))
+        self.seed.pack(side=tk.LEFT)
+        self.optimize_travel = tk.Checkbutton(
+            self, text="optimize\ntravel", variable=controller.optimize_travel).pack(side=tk.LEFT)
+
+
+class PlotterOptions(tk.Frame):
+    def __init__(self, parent, controller):
+        tk.Frame.__init__(self, parent)
+        self.parent = parent
+        ttk.Separator(self, orient='horizontal').pack(fill='x')
+        self.plot_width = tk.Scale(
+            self,
+            from_=50,
+            to=1000,
+            resolution=10,
+            length=200,
+            label="plot width (mm)",
+            width=5,
+            orient=tk.HORIZONTAL,
+            variable=controller.plot_width).pack()
+        self.plot_feed_rate = tk.Scale(
+            self,
+            from_=100,
+            to=10000,
+            resolution=100,
+            length=200,
+            label="feed rate (mm/min)",
+            width=5,
+            orient=tk.HORIZONTAL,
+            variable=controller.plot_feed_rate).pack()
+        ttk.Separator(self, orient='horizontal').pack(fill='x')
+        tk.Label(self, text="G-code pen up").pack()
+        self.plot_pen_up = tk.Entry(
+            self, textvariable=controller.plot_pen_up).pack()
+        tk.Label(self, text="G-code pen down").pack()
+        self.plot_pen_down = tk.Entry(
+            self, textvariable=controller.plot_pen_down).pack()
+
 
+class PreviewFigure(tk.Frame):
+    '''figure of image panels: every axes gets one image artist that is updated with
+    set_data, images are reduced to the on-screen size of their axes and the canvas is only
+    redrawn while its notebook tab is visible (hidden tabs are redrawn when selected)'''
 
-class ControlFigure(tk.Frame):
     def __init__(self, parent):
         tk.Frame.__init__(self, parent)
         self.parent = parent
         self.fig = Figure(figsize=(6.5, 6.5))
+        self.images = {}
+        self.stale = False
+
+    def add_canvas(self):
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self)
+        self.canvas.get_tk_widget().pack(side=tk.TOP, padx=10, pady=10)
+        self.toolbar = NavigationToolbar2Tk(
+            self.canvas, self, pack_toolbar=False)
+        self.toolbar.pack(side=tk.BOTTOM)
+
+    def show(self, ax, image, shape=None):
+        '''display a grayscale image on ax, the extent covers shape (height, width) pixels
+        (default: the image shape), so previews of a different size line up'''
+        height, width = image.shape if shape is None else shape
+        bbox = ax.get_window_extent()
+        data = downsample(image, (max(1, bbox.height), max(1, bbox.width)))
+        extent = (-0.5, width - 0.5, height - 0.5, -0.5)
+        artist = self.images.get(ax)
+        if artist is None:
+            artist = self.images[ax] = ax.imshow(data, 'gray', extent=extent)
+        else:
+            artist.set_data(data)
+            artist.set_extent(extent)
+        # the contrast of the full image, block means narrow the range of noisy images
+        artist.set_clim(float(np.min(image)), float(np.max(image)))
+
+    def redraw(self):
+        if self.winfo_ismapped():
+            self.stale = False
+            self.canvas.draw_idle()
+        else:
+            self.stale = True
+
+    def refresh(self):
+        '''redraw the changes made while the tab was hidden'''
+        if self.stale:
+            self.stale = False
+            self.canvas.draw_idle()
+
+
+class ControlFigure(PreviewFigure):
+    def __init__(self, parent):
+        PreviewFigure.__init__(self, parent)
         self.original = self.fig.add_subplot(2, 2, 1, frame_on=False)
         self.original.set_title('Original')
         self.original.tick_params(axis='both', labelsize=8)
@@ -408,18 +538,12 @@ class ControlFigure(tk.Frame):
         self.flow_field.set_title('Flowfield')
         self.edgemap = self.fig.add_subplot(2, 2, 4, frame_on=False)
         self.edgemap.set_title('Edge Map')
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self)
-        self.canvas.get_tk_widget().pack(side=tk.TOP, padx=10, pady=10)
-        self.toolbar = NavigationToolbar2Tk(
-            self.canvas, self, pack_toolbar=False)
-        self.toolbar.pack(side=tk.BOTTOM)
+        self.add_canvas()
 
 
-class ThresholdFigure(tk.Frame):
+class ThresholdFigure(PreviewFigure):
     def __init__(self, parent):
-        tk.Frame.__init__(self, parent)
-        self.parent = parent
-        self.fig = Figure(figsize=(6.5, 6.5))
+        PreviewFigure.__init__(self, parent)
         self.thresh_low = self.fig.add_subplot(2, 2, 1, frame_on=False)
         self.thresh_low.set_title('dark tones')
         self.thresh_low.tick_params(axis='both', labelsize=8)
@@ -429,18 +553,12 @@ class ThresholdFigure(tk.Frame):
         self.thresh_midhigh.set_title('light mids')
         self.thresh_high = self.fig.add_subplot(2, 2, 4, frame_on=False)
         self.thresh_high.set_title('highlights')
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self)
-        self.canvas.get_tk_widget().pack(side=tk.TOP, padx=10, pady=10)
-        self.toolbar = NavigationToolbar2Tk(
-            self.canvas, self, pack_toolbar=False)
-        self.toolbar.pack(side=tk.BOTTOM)
+        self.add_canvas()
 
 
-class XDoGThresholdFigure(tk.Frame):
+class XDoGThresholdFigure(PreviewFigure):
     def __init__(self, parent):
-        tk.Frame.__init__(self, parent)
-        self.parent = parent
-        self.fig = Figure(figsize=(6.5, 6.5))
+        PreviewFigure.__init__(self, parent)
         self.thresh_low = self.fig.add_subplot(2, 2, 1, frame_on=False)
         self.thresh_low.set_title('dark tones masked')
         self.thresh_low.tick_params(axis='both', labelsize=8)
@@ -453,11 +571,7 @@ class XDoGThresholdFigure(tk.Frame):
         self.thresh_high = self.fig.add_subplot(2, 2, 4, frame_on=False)
         self.thresh_high.set_title('highlights masked')
         # self.thresh_high.axis('off')
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self)
-        self.canvas.get_tk_widget().pack(side=tk.TOP, padx=10, pady=10)
-        self.toolbar = NavigationToolbar2Tk(
-            self.canvas, self, pack_toolbar=False)
-        self.toolbar.pack(side=tk.BOTTOM)
+        self.add_canvas()
 
 
 class OutputFigure(tk.Frame):
@@ -480,9 +594,9 @@ class Buttons(tk.Frame):
         tk.Frame.__init__(self, parent)
         self.parent = parent
         self.recalculate_btn = tk.Button(
-            self, text="Trace Image", command=lambda: controller.run_threaded(controller.trace_image)).grid(row=0, column=1, padx=5, pady=5, ipadx=37, ipady=5)
+            self, text="Trace Image", command=controller.trace_image).grid(row=0, column=1, padx=5, pady=5, ipadx=37, ipady=5)
         self.recalculate_btn = tk.Button(
-            self, text="Recalculate Everything", command=lambda: controller.run_threaded(controller.calculate_all)).grid(row=1, column=1, padx=5, pady=5, ipadx=10, ipady=5)
+            self, text="Recalculate Everything", command=controller.recalculate).grid(row=1, column=1, padx=5, pady=5, ipadx=10, ipady=5)
         self.preview_btn = tk.Button(
             self, text="Preview in Browser", command=controller.show_output).grid(row=2, column=1, padx=5, pady=10, ipadx=20, ipady=5)
         self.open_file_btn = tk.Button(
@@ -493,6 +607,18 @@ class Buttons(tk.Frame):
             self, text="Load config...", command=controller.load_config).grid(row=4, column=1, padx=5, pady=5)
         self.save_output_btn = tk.Button(
             self, text="Save Output...", command=controller.save_output).grid(row=3, column=2, padx=5, pady=5)
+        self.progressive_preview = tk.Checkbutton(
+            self, text="progressive preview", variable=controller.progressive_preview).grid(row=4, column=2, padx=5, pady=5)
+        self.export_profile_btn = tk.Button(
+            self, text="Export profile...", command=controller.export_profile).grid(row=4, column=0, padx=5, pady=5)
+        self.profile_memory = tk.Checkbutton(
+            self, text="profile memory", variable=controller.profile_memory).grid(row=5, column=0, padx=5, pady=5)
+        self.float32_pipeline = tk.Checkbutton(
+            self, text="float32 pipeline", variable=controller.float32_pipeline).grid(row=5, column=1, padx=5, pady=5)
+        tk.Label(self, text="blur").grid(row=6, column=0, padx=5, pady=5, sticky='e')
+        self.blur_backend = ttk.Combobox(
+            self, textvariable=controller.blur_backend, values=BACKENDS, state='readonly', width=8)
+        self.blur_backend.grid(row=6, column=1, padx=5, pady=5, sticky='w')
 
 
 class StatusBar(tk.Frame):
@@ -517,6 +643,7 @@ class MenuFrame(tk.Frame):
         self.threshold_sliders = TresholdSliders(self, controller)
         self.path_length_sliders = PathlengthSliders(self, controller)
         self.path_distance_sliders = PathdistanceSliders(self, controller)
+        self.plotter_options = PlotterOptions(self, controller)
 
         self.conf_tabs.add(self.xdog_sliders, text="XDoG")
         self.conf_tabs.add(self.flowfield_sliders, text="Flow Field")
@@ -525,6 +652,7 @@ class MenuFrame(tk.Frame):
         self.output_tabs.add(self.path_length_sliders, text="Path length")
         self.output_tabs.add(self.path_distance_sliders,
                              text="Path Distance / Crosshatch")
+        self.output_tabs.add(self.plotter_options, text="Plotter")
 
         self.output_tabs.pack(side=tk.RIGHT, anchor=tk.NE,
                               ipady=22, ipadx=15, padx=5, pady=2)
@@ -546,7 +674,11 @@ class Mainview(tk.Frame):
         self.plot_tabs.add(self.xdog_threshold_frame,
                            text="XDoG Masks")
         self.plot_tabs.add(self.threshold_frame, text="Threshold Masks")
+        self.plot_tabs.bind('<<NotebookTabChanged>>', self.tab_changed)
 
         self.plot_tabs.grid(row=0, column=0, rowspan=2, sticky=tk.N)
         self.menu_frame.grid(row=0, column=1, rowspan=1, sticky=tk.N)
         self.buttons.grid(row=1, column=1, rowspan=1, sticky=tk.N)
+
+    def tab_changed(self, event):
+        self.nametowidget(self.plot_tabs.select()).refresh()
@@ -0,0 +1,118 @@
+import threading
+import time
+import numpy as np
+import hatchybatch.application as application
+from hatchybatch.application import Controller
+from hatchybatch.instrument import Recorder
+from hatchybatch.models import ConfigData
+from hatchybatch.scheduler import Scheduler
+
+
+class FakeRoot():
+    '''the after() queue of a Tk root, run by pump()'''
+
+    def __init__(self):
+        self.calls = []
+
+    def after(self, ms, func, *args):
+        self.calls.append((func, args))
+
+    def pump(self):
+        calls, self.calls = self.calls, []
+        for func, args in calls:
+            func(*args)
+
+
+class Var():
+    def __init__(self, value=None):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class Stub():
+    '''model, proxy and tracer stand-in'''
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def settle(root, scheduler, timeout=10):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        root.pump()
+        if not scheduler.busy() and scheduler.results.empty():
+            root.pump()
+            return
+        time.sleep(0.01)
+    raise TimeoutError('scheduler did not settle')
+
+
+def test_setting_change_during_proxy_phase_discards_stale_tracer(monkeypatch):
+    root = FakeRoot()
+    settings = ConfigData.with_defaults({'progressive_preview': True})
+    proxy_running = threading.Event()
+    release = threading.Event()
+
+    def calculate_stages(model, config):
+        proxy_running.set()
+        release.wait(10)
+
+    def trace(model, config):
+        return Stub(seed=config['seed'], _paths=Stub(), imageshape=None)
+
+    monkeypatch.setattr(application, 'calculate_stages', calculate_stages)
+    monkeypatch.setattr(application, 'iter_stages', lambda model, config: iter(()))
+    monkeypatch.setattr(application, 'trace', trace)
+
+    controller = Controller.__new__(Controller)
+    controller.root = root
+    controller.recorder = Recorder()
+    controller.profile_memory = Var(False)
+    controller.status_text = Var()
+    controller.model = Stub(source=np.zeros((8, 8)), proxy=lambda scale: Stub())
+    controller.get_config = lambda: dict(settings)
+    controller.draw_all = lambda model: None
+    installed = []
+    controller.set_tracer = lambda tracer: installed.append(tracer.seed)
+    controller.scheduler = Scheduler(root, interval=1)
+    controller.scheduler.start()
+
+    controller.recalculate()
+    assert proxy_running.wait(10)
+    settings['seed'] = 7
+    controller.parameters_changed('seed')
+    release.set()
+    settle(root, controller.scheduler)
+
+    assert installed and set(installed) == {7}
+
+
+def test_follow_up_job_is_cancelled_with_its_parent():
+    root = FakeRoot()
+    scheduler = Scheduler(root, interval=1)
+    scheduler.start()
+    submitted = threading.Event()
+    release = threading.Event()
+    done = []
+
+    def work(job):
+        scheduler.submit('child', lambda child: 'stale', done.append, parent=job)
+        submitted.set()
+        release.wait(10)
+        job.check()
+
+    scheduler.submit('parent', work, done.append)
+    assert submitted.wait(10)
+    assert scheduler.cancel('parent')
+    release.set()
+    settle(root, scheduler)
+
+    assert done == []